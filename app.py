@@ -1,27 +1,110 @@
 import streamlit as st
 import os
 import threading
-import queue
+import concurrent.futures
+import collections
+import heapq
+import stat
 import time
-import glob
 
 import subprocess
 import re  # for regex parsing in system info
 
 from system_info import cpu_info, gpu_info, check_mmpbsa_installed
-from mdp_utils import update_mdp_nsteps, get_mdp_file, generate_default_mmpbsa_in
+from mdp_utils import update_mdp_nsteps, get_mdp_file, generate_default_mmpbsa_in, atomic_write_text
 from gromacs_runner import detect_index_groups, run_md, stop_md, run_mmpbsa
 
-# --------------------------------------------------
-# Module-level lock for thread safety
-# --------------------------------------------------
-_state_lock = threading.Lock()
-
 # --------------------------------------------------
 # Constants
 # --------------------------------------------------
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100 MB
+LOG_TAIL_BYTES = 256 * 1024  # Tail of a log file shown by the log viewer
+VIEW_PREVIEW_BYTES = 256 * 1024  # Larger files are previewed as head + tail
+MAX_LOG_FILES_SHOWN = 10  # Most recent log files listed in the MD tab
 MAX_SIMULATION_TIME_NS = 1000  # Maximum simulation time in nanoseconds
+LOG_QUEUE_MAXLEN = 10000  # Pending MMPBSA log lines buffered between reruns
+# Pending MD output batches (one per pipe read, up to 64 KiB each) buffered
+# between reruns; the oldest are evicted beyond this and counted as dropped
+LOG_QUEUE_MAX_BATCHES = 1000
+LOG_HISTORY_MAXLEN = 5000  # Log lines kept in the session for display
+ANALYSIS_LOG_MAXLEN = 80  # MMPBSA log lines kept (and shown) in the session
+REFRESH_INTERVAL = 2.0  # Max seconds between reruns while a job is running
+MIN_REFRESH_INTERVAL = 0.5  # Min seconds between redraws; bursts are coalesced
+
+# Files that must exist in the GROMACS directory before each stage can run
+STAGE_REQUIRED_FILES = {
+    "setup": frozenset({"topol.top", "step3_input.gro"}),
+    "equilibration": frozenset({"topol.top"}),
+    "production": frozenset({"topol.top"})
+}
+
+# CHARMM-GUI inputs listed in the MD tab
+MD_INPUT_FILES = (
+    "step3_input.gro",
+    "step3_input.pdb",
+    "step4_0_minimization.mdp",
+    "step4.1_equilibration.mdp",
+    "step4_equilibration.mdp",
+    "step5_production.mdp",
+    "topol.top"
+)
+
+# Files listed in the MMPBSA tab, and the subset gmx_MMPBSA needs to run
+MMPBSA_DISPLAY_FILES = (
+    "md.tpr", "md.xtc", "index.ndx", "topol.top",
+    "mmpbsa.in", "md.gro", "md.log", "md.edr", "md.cpt"
+)
+MMPBSA_REQUIRED_FILES = ("md.tpr", "md.xtc", "index.ndx", "topol.top", "mmpbsa.in")
+
+# Stages that can only run once Setup has completed
+GATED_STAGES = ("equilibration", "production")
+
+STAGE_INFO = {
+    "setup": "🔧 Initialize system, run energy minimization",
+    "equilibration": "🌡️ Warm up system, equilibrate temperature & pressure",
+    "production": "🎬 Collect production MD data for analysis"
+}
+
+STATUS_EMOJI = {
+    "running": "🟢",
+    "paused": "⏸",
+    "finished": "✅",
+    "idle": "⏹"
+}
+
+# Output prefix (and full log file name) run_md uses for each stage
+STAGE_OUTPUT_PREFIX = {
+    "setup": "setup",
+    "equilibration": "equil",
+    "production": "md"
+}
+
+GMX_CHECK_TIMEOUT = 15  # Seconds allowed for `gmx check` on the trajectory
+GMX_DUMP_TIMEOUT = 20  # Seconds allowed for `gmx dump` on the run input
+_FRAMES_RE = re.compile(r"Found\s+(\d+)\s+frames")
+_NATOMS_RE = re.compile(r"natoms\s*=\s*(\d+)")
+# mmpbsa.in sections written by "Apply settings"
+MMPBSA_IN_GENERAL = """&general
+sys_name = "Protein-Ligand",
+startframe = {start_frame},
+endframe = {end_frame},
+interval = {interval},
+verbose = {verbose},
+/
+"""
+MMPBSA_IN_GB = """&gb
+igb = 5,
+saltcon = {salt_con},
+/
+"""
+MMPBSA_IN_PB = """&pb
+istrng = {salt_con},
+fillratio = 4.0,
+/
+"""
+
+FINISHED_SCAN_BYTES = 4096  # Tail of md.log searched for mdrun's closing line
+_FINISHED_RE = re.compile(rb"Finished(?: writing| mdrun|\b)")
 
 # --------------------------------------------------
 # Setup
@@ -33,9 +116,13 @@ st.title("🧪 GROMACS MD Runner (CHARMM-GUI)")
 # Session state defaults
 # --------------------------------------------------
 defaults = {
-    "logs": [],
+    "logs_joined": "",
+    "logs_dropped": 0,  # Lines of the current run evicted from the capped history
+    "log_seq": 0,  # Total log lines collected (history is capped, this isn't)
     "running": False,
     "paused": False,
+    "pause_requested": False,  # Pause clicked: the run's exit is a pause, not completion
+    "pause_failed": False,  # stop_md could not stop the run
     "finished": False,
     "error": None,
     "progress": 0,
@@ -45,48 +132,534 @@ defaults = {
     "current_stage": "setup",
     "setup_completed": False,
     "last_log_file": None,
-    "md_thread": None,
+    "md_future": None,
+    "stop_future": None,
+    "analysis_future": None,
+    "completion_celebrated": False,  # Balloons already shown for this run
     "_prev_setup_completed": False,
     "analysis_running": False,
     "analysis_finished": False,
     "analysis_progress": 0,
-    "analysis_logs": [],
-    "analysis_log_queue": queue.Queue(),  # ← ADD THIS
+    "analysis_log_seq": 0,  # Total MMPBSA lines collected (history is capped)
     "show_mmpbsa_logs": False,
 }
 
-for k, v in defaults.items():
-    if k not in st.session_state:
-        st.session_state[k] = v
+# Per-session objects, built only when the key is first missing. The log
+# queues are deques: lock-free append/popleft between the worker threads
+# (producers) and the script (consumer). The progress slots hold only the
+# latest value a worker reported; older ones are dropped unread.
+factories = {
+    "logs": lambda: collections.deque(maxlen=LOG_HISTORY_MAXLEN),
+    "log_queue": collections.deque,  # Bounded by log_callback, which counts evictions
+    "log_evicted": collections.deque,  # Line counts of batches evicted from log_queue
+    "analysis_logs": lambda: collections.deque(maxlen=ANALYSIS_LOG_MAXLEN),
+    "analysis_log_queue": lambda: collections.deque(maxlen=LOG_QUEUE_MAXLEN),
+    "progress_slot": lambda: collections.deque(maxlen=1),
+    "pid_slot": lambda: collections.deque(maxlen=1),
+    "analysis_progress_slot": lambda: collections.deque(maxlen=1),
+    "update_event": threading.Event,  # Set by worker threads on new output/state
+    # Long jobs (one MD run, one MMPBSA run at a time) get this session's own
+    # workers, so other sessions' runs never queue them
+    "job_executor": lambda: concurrent.futures.ThreadPoolExecutor(
+        max_workers=2, thread_name_prefix="md-runner"
+    ),
+}
 
-# Initialize Queue separately for each session
-if "log_queue" not in st.session_state:
-    st.session_state.log_queue = queue.Queue()
+for k in (defaults.keys() | factories.keys()) - st.session_state.keys():
+    st.session_state[k] = factories[k]() if k in factories else defaults[k]
 
 # --------------------------------------------------
 # Helper Functions
 # --------------------------------------------------
-def safe_read_file(filepath, max_size=MAX_FILE_SIZE):
-    """Safely read file with size check"""
+def safe_read_file(filepath, max_size=MAX_FILE_SIZE, tail_bytes=None):
+    """
+    Safely read file with size check
+
+    If tail_bytes is given and the file is larger, only the last
+    tail_bytes are read (starting at the next full line), so viewing a
+    long, growing log costs the same regardless of its size.
+    """
     try:
-        file_size = os.path.getsize(filepath)
-        if file_size > max_size:
-            raise ValueError(
-                f"File too large: {file_size / 1024 / 1024:.1f} MB "
-                f"(max {max_size / 1024 / 1024:.1f} MB)"
-            )
-        
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
+        with open(filepath, 'rb') as f:
+            file_size = f.seek(0, os.SEEK_END)
+            if tail_bytes is not None and file_size > tail_bytes:
+                f.seek(-tail_bytes, os.SEEK_END)
+                f.readline()  # skip the partial first line
+            else:
+                if file_size > max_size:
+                    raise ValueError(
+                        f"File too large: {file_size / 1024 / 1024:.1f} MB "
+                        f"(max {max_size / 1024 / 1024:.1f} MB)"
+                    )
+                f.seek(0)
+            return f.read().decode('utf-8', errors='ignore')
     except Exception as e:
         raise Exception(f"Error reading file: {str(e)}")
 
+@st.cache_data(max_entries=16, ttl=60, show_spinner=False)
+def _cached_read_file(filepath, mtime_ns, size, tail_bytes):
+    """safe_read_file keyed on (path, mtime, size), so reruns reuse the text"""
+    return safe_read_file(filepath, tail_bytes=tail_bytes)
+
+def read_file_cached(filepath, tail_bytes=None):
+    """
+    Read a file for display through the cache. The file is stat'ed on every
+    call, so the cached text is replaced as soon as the file changes.
+    """
+    try:
+        stat_result = os.stat(filepath)
+    except OSError as e:
+        raise Exception(f"Error reading file: {str(e)}")
+    return _cached_read_file(filepath, stat_result.st_mtime_ns, stat_result.st_size, tail_bytes)
+
+@st.cache_data(max_entries=16, ttl=60, show_spinner=False)
+def _cached_file_preview(filepath, mtime_ns, size, limit):
+    """
+    (text, truncated) for a file: all of it if it fits in `limit` bytes,
+    otherwise its first and last limit/2 bytes cut at line boundaries
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            if size <= limit:
+                return f.read().decode('utf-8', errors='ignore'), False
+            half = limit // 2
+            head = f.read(half)
+            f.seek(-half, os.SEEK_END)
+            tail = f.read()
+    except OSError as e:
+        raise Exception(f"Error reading file: {str(e)}")
+
+    head = head[:head.rfind(b"\n") + 1] or head
+    tail = tail[tail.find(b"\n") + 1:] or tail
+    skipped_kb = (size - len(head) - len(tail)) / 1024
+    return (
+        head.decode('utf-8', errors='ignore')
+        + f"\n... [{skipped_kb:,.0f} KB not shown] ...\n\n"
+        + tail.decode('utf-8', errors='ignore')
+    ), True
+
+def show_file(filepath, key):
+    """
+    Render a file for viewing. Small files get st.code; large ones show only
+    their start and end in a plain text area, so the browser never receives
+    (or highlights) the whole file.
+    """
+    try:
+        stat_result = os.stat(filepath)
+    except OSError as e:
+        raise Exception(f"Error reading file: {str(e)}")
+    content, truncated = _cached_file_preview(
+        filepath, stat_result.st_mtime_ns, stat_result.st_size, VIEW_PREVIEW_BYTES
+    )
+    if truncated:
+        st.text_area(
+            "File content", value=content, height=400, disabled=True,
+            label_visibility="collapsed", key=key
+        )
+        st.caption(f"Showing the start and end of a {stat_result.st_size / 1024 / 1024:.1f} MB file; full file: `{filepath}`")
+    else:
+        st.code(content, language="text")
+
+def _dir_mtime(path):
+    """
+    Directory mtime in ns, or 0 if `path` isn't a directory. Used both as a
+    cache key and as the existence check, so each directory costs one stat.
+    """
+    try:
+        stat_result = os.stat(path)
+    except (OSError, ValueError):
+        return 0
+    return stat_result.st_mtime_ns if stat.S_ISDIR(stat_result.st_mode) else 0
+
+def _iter_files(path):
+    """
+    Yield a DirEntry for each regular file in a directory (nothing if it
+    can't be read). is_file() is answered from the d_type returned by
+    getdents, and DirEntry.stat() caches its result, so callers never need
+    a separate os.path.getsize/getmtime.
+    """
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file():
+                    yield entry
+    except OSError:
+        return
+
+@st.cache_data(ttl=2, show_spinner=False)
+def _scan_dir(path, mtime):
+    """
+    One scandir pass over a directory: the set of regular file names plus
+    (path, size, mtime) for every *.log among them. Pass the directory
+    mtime so the cached result is invalidated as soon as a file is added
+    or removed.
+    """
+    names = set()
+    log_files = []
+    for entry in _iter_files(path):
+        names.add(entry.name)
+        if not entry.name.endswith(".log"):
+            continue
+        try:
+            stat_result = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        log_files.append((entry.path, stat_result.st_size, stat_result.st_mtime))
+    return names, log_files
+
+def refresh_signature():
+    """
+    Snapshot of the worker-driven state that shapes the page. A change here
+    needs a full rerun; progress and log lines are redrawn in place.
+    """
+    ss = st.session_state
+    return (
+        ss.running, ss.paused, ss.finished, ss.error, ss.setup_completed,
+        ss.analysis_running, ss.analysis_finished,
+        ss.md_future is not None and ss.md_future.done(),
+        ss.analysis_future is not None and ss.analysis_future.done(),
+        ss.stop_future is not None and ss.stop_future.done()
+    )
+
+def _drain(queue):
+    """
+    Pop everything queued so far in one pass; items appended meanwhile are
+    left for the next drain. The MD producer may evict the oldest item
+    concurrently, so the deque can run out before len() items are popped.
+    """
+    items = []
+    for _ in range(len(queue)):
+        try:
+            items.append(queue.popleft())
+        except IndexError:
+            break
+    return items
+
+def _finish_md(future):
+    """Apply the outcome of a completed run_job future to session state"""
+    ss = st.session_state
+    ss.running = False
+    ss.md_pid = None
+    ss.pid_slot.clear()
+    if ss.pause_requested:
+        # mdrun exits cleanly on SIGTERM: the run was paused, not completed,
+        # so it stays resumable and doesn't unlock later stages
+        ss.paused = True
+        return
+    ss.paused = False
+    try:
+        stage, result = future.result()
+    except Exception as e:
+        ss.error = str(e)
+        ss.finished = False
+        ss.log_queue.append(f"\n❌ Error: {str(e)}\n")
+        return
+
+    # force completion state
+    ss.progress = 100
+    ss.finished = True
+
+    # unlock next stages
+    if stage == "setup" and result == 0:
+        ss.setup_completed = True
+        ss.log_queue.append("\n✅ Setup stage completed! You can now run Equilibration and Production.\n")
+
+def _finish_analysis(future):
+    """Apply the outcome of a completed MMPBSA future to session state"""
+    ss = st.session_state
+    ss.analysis_running = False
+    error = future.exception()
+    if error is not None:
+        ss.error = str(error)
+    else:
+        ss.analysis_finished = True
+        ss.analysis_progress = 100
+
+def drain_log_queue():
+    """
+    Pick up finished MD/MMPBSA/stop futures, then move lines queued by the workers
+    into session history in one batch each. Only this (script) thread changes
+    run state, so no lock is needed. Returns True if the run state changed.
+    """
+    ss = st.session_state
+    changed = False
+
+    if ss.pid_slot:
+        ss.md_pid = ss.pid_slot.pop()
+
+    # Latest progress only, taken before completion sets it to 100
+    if ss.progress_slot:
+        ss.progress = ss.progress_slot.pop()
+    if ss.analysis_progress_slot:
+        ss.analysis_progress = ss.analysis_progress_slot.pop()
+
+    # A finished worker has queued all of its output, so its closing lines
+    # land after it in the same drain
+    if ss.md_future is not None and ss.md_future.done():
+        _finish_md(ss.md_future)
+        ss.md_future = None
+        changed = True
+
+    if ss.analysis_future is not None and ss.analysis_future.done():
+        _finish_analysis(ss.analysis_future)
+        ss.analysis_future = None
+        changed = True
+
+    if ss.stop_future is not None and ss.stop_future.done():
+        try:
+            stopped = ss.stop_future.result()
+        except Exception:
+            stopped = False
+        ss.stop_future = None
+        ss.pause_failed = not stopped
+        if not stopped and ss.md_future is not None:
+            # mdrun is still going: the pause didn't happen
+            ss.pause_requested = False
+            ss.paused = False
+            ss.running = True
+        changed = True
+
+    # run_md sends output a read batch at a time; split it into lines here,
+    # in one call, rather than calling back per line on the worker thread
+    new_lines = _drain(ss.log_queue)
+    if new_lines:
+        new_lines = "".join(new_lines).splitlines(keepends=True)
+
+    # Batches the worker evicted from a full queue count as dropped lines
+    evicted = _drain(ss.log_evicted)
+    if evicted:
+        ss.logs_dropped += sum(evicted)
+
+    if new_lines:
+        # Extend once and keep the joined text up to date incrementally; only
+        # rebuild it when the bounded history drops its oldest lines.
+        logs = ss.logs
+        dropped = max(0, len(logs) + len(new_lines) - logs.maxlen)
+        logs.extend(new_lines)
+        ss.log_seq += len(new_lines)
+        if dropped:
+            ss.logs_dropped += dropped
+            ss.logs_joined = "".join(logs)
+        else:
+            ss.logs_joined += "".join(new_lines)
+
+    analysis_lines = _drain(ss.analysis_log_queue)
+    if analysis_lines:
+        ss.analysis_logs.extend(analysis_lines)
+        ss.analysis_log_seq += len(analysis_lines)
+
+    return changed
+
+def render_progress(progress_placeholder, info_placeholder):
+    """Draw the MD progress bar and stage summary into their placeholders"""
+    ss = st.session_state
+    progress_placeholder.progress(ss.progress / 100.0 if ss.progress <= 100 else 1.0)
+    info_placeholder.info(
+        f"📌 Current Stage: **{ss.current_stage.capitalize()}** | "
+        f"Total steps: **{ss.total_steps:,}** | "
+        f"Progress: **{ss.progress}%**"
+    )
+
+def render_analysis_log(log_placeholder):
+    """Draw the MMPBSA log viewer into its placeholder"""
+    ss = st.session_state
+    if ss.analysis_logs:
+        # Keyed by analysis_log_seq so it can be redrawn within one run
+        log_placeholder.text_area(
+            "MMPBSA Output Log",
+            value="\n".join(ss.analysis_logs),
+            height=300,
+            disabled=True,
+            key=f"mmpbsa_log_{ss.analysis_log_seq}"
+        )
+    else:
+        log_placeholder.info("Waiting for output... (gmx_MMPBSA is preparing files — this can take a while)")
+
+def render_log(log_placeholder):
+    """Draw the MD log viewer into its placeholder"""
+    ss = st.session_state
+    if not ss.logs:
+        log_placeholder.empty()
+        return
+    with log_placeholder.container():
+        st.markdown("### 🖥 MD Run Log")
+        # Only the bounded tail kept in session state is sent to the browser;
+        # the complete log stays on disk. Keyed by log_seq so it can be
+        # redrawn several times in one run.
+        st.text_area(
+            "MD Run Log",
+            value=ss.logs_joined,
+            height=400,
+            label_visibility="collapsed",
+            key=f"log_display_{ss.log_seq}"
+        )
+        if ss.logs_dropped:
+            st.caption(f"{ss.logs_dropped:,} earlier lines not shown")
+        # The complete log streams from disk; offered once the run stops,
+        # so in-place redraws during a run don't re-read a growing file
+        if not ss.running and ss.last_log_file and os.path.isfile(ss.last_log_file):
+            with open(ss.last_log_file, "rb") as log_fh:
+                st.download_button(
+                    "⬇ Download full log",
+                    data=log_fh,
+                    file_name=os.path.basename(ss.last_log_file),
+                    mime="text/plain",
+                    key=f"log_download_{ss.log_seq}"
+                )
+
+def _file_key(path):
+    """(mtime_ns, size) of a regular file for use as a cache key, or None"""
+    try:
+        stat_result = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    return stat_result.st_mtime_ns, stat_result.st_size
+
+def _count_frames(xtc_path):
+    """
+    Frames in a trajectory via `gmx check`, as (ok, frames). frames is None
+    if gmx succeeded but reported no count.
+    """
+    result = subprocess.run(
+        ["gmx", "check", "-f", xtc_path],
+        capture_output=True, text=True, timeout=GMX_CHECK_TIMEOUT, check=False
+    )
+    if result.returncode != 0:
+        return False, None
+    frames_match = _FRAMES_RE.search(result.stdout) or _FRAMES_RE.search(result.stderr)
+    return True, int(frames_match.group(1)) if frames_match else None
+
+def _count_atoms(tpr_path):
+    """
+    Atom count from `gmx dump`, as (ok, natoms). natoms appears in the
+    header, so the dump is read line by line and stopped at the first
+    match instead of buffering the whole (often very large) text dump.
+    """
+    proc = subprocess.Popen(
+        ["gmx", "dump", "-s", tpr_path],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        bufsize=1 << 16
+    )
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(GMX_DUMP_TIMEOUT, _kill)
+    timer.start()
+    natoms = None
+    try:
+        for line in proc.stdout:
+            atoms_match = _NATOMS_RE.search(line)
+            if atoms_match:
+                natoms = int(atoms_match.group(1))
+                break
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            proc.terminate()
+        proc.stdout.close()
+        returncode = proc.wait()
+
+    if natoms is not None:
+        return True, natoms
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(proc.args, GMX_DUMP_TIMEOUT)
+    return returncode == 0, None
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _gmx_introspect(xtc_path, xtc_key, tpr_path, tpr_key):
+    """
+    (frames result, atoms result) for a trajectory and run input, keyed on
+    both files' (mtime_ns, size). gmx check and gmx dump each pay GROMACS
+    startup, so they run side by side on their own two workers.
+    """
+    executor = get_probe_executor()
+    frames_future = executor.submit(_count_frames, xtc_path)
+    atoms_future = executor.submit(_count_atoms, tpr_path)
+    return frames_future.result(), atoms_future.result()
+
+@st.cache_data(ttl=10, show_spinner=False)
+def _log_finished(log_path, file_key):
+    """Whether an md.log ends with mdrun's "Finished" line (raw tail, no decoding)"""
+    try:
+        with open(log_path, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - FINISHED_SCAN_BYTES))
+            tail = f.read()
+    except OSError:
+        return False
+    return _FINISHED_RE.search(tail) is not None
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _resolve_mdp_file(gromacs_dir, stage, dir_mtime):
+    """
+    get_mdp_file keyed on the directory mtime, so repeated lookups (validation,
+    then the run itself) don't re-probe every candidate name. Creating a
+    fallback MDP changes the mtime, which invalidates the entry.
+    """
+    return get_mdp_file(gromacs_dir, stage)
+
+@st.cache_resource
+def get_probe_executor():
+    """
+    Pool for the gmx check / gmx dump probes, apart from the job and control
+    workers so a tab render never waits behind a running job
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="gmx-probe")
+
+@st.cache_resource
+def get_control_executor():
+    """
+    Shared pool for process control (stop_md): kept apart from the job
+    workers so a Pause never waits behind hours-long runs
+    """
+    return concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="md-control")
+
+def apply_mdp_nsteps(mdp_path, ns):
+    """
+    Set nsteps in the MDP file for a run of `ns` nanoseconds
+
+    Skips the read/backup/rewrite when this session already wrote the same
+    value to the same, unmodified file (e.g. Run clicked again after a pause).
+    """
+    last = st.session_state.get("_mdp_nsteps_written")
+    if last and last[:3] == (mdp_path, os.stat(mdp_path).st_mtime_ns, ns):
+        return last[3]
+
+    nsteps = update_mdp_nsteps(mdp_path, ns)
+    st.session_state._mdp_nsteps_written = (mdp_path, os.stat(mdp_path).st_mtime_ns, ns, nsteps)
+    return nsteps
+
+def write_mmpbsa_in(path, content):
+    """
+    Atomically write mmpbsa.in (unique temp file + os.replace, so a reader
+    never sees a half-written file and the file keeps its mode)
+
+    Returns False without touching the file when this session already wrote
+    the same content to it and it hasn't been modified since.
+    """
+    last = st.session_state.get("_mmpbsa_in_written")
+    try:
+        if last and last == (path, os.stat(path).st_mtime_ns, content):
+            return False
+    except OSError:
+        pass
+
+    atomic_write_text(path, content)
+    st.session_state._mmpbsa_in_written = (path, os.stat(path).st_mtime_ns, content)
+    return True
+
 def validate_inputs(charmm_dir, ns, threads, cpus, current_stage):
     """Validate all inputs before running simulation"""
     errors = []
     
     # Check directory
-    if not charmm_dir or not os.path.isdir(charmm_dir):
+    charmm_mtime = _dir_mtime(charmm_dir) if charmm_dir else 0
+    if not charmm_mtime:
         errors.append("Invalid GROMACS directory")
         return errors  # Early return if directory is invalid
     
@@ -100,38 +673,59 @@ def validate_inputs(charmm_dir, ns, threads, cpus, current_stage):
     if threads < 1 or threads > cpus:
         errors.append(f"Threads must be between 1 and {cpus}")
     
-    # Check required files based on stage
-    required_files = {
-        "setup": ["topol.top", "step3_input.gro"],
-        "equilibration": ["topol.top"],
-        "production": ["topol.top"]
-    }
-    
-    for file in required_files.get(current_stage, []):
-        if not os.path.exists(os.path.join(charmm_dir, file)):
-            errors.append(f"Missing required file: {file}")
+    # Check required files based on stage (one directory scan, set lookups)
+    present, _ = _scan_dir(charmm_dir, charmm_mtime)
+    missing = STAGE_REQUIRED_FILES.get(current_stage, frozenset()) - present
+    errors.extend(f"Missing required file: {file}" for file in sorted(missing))
     
     # Check MDP file exists
     try:
-        mdp_path = get_mdp_file(charmm_dir, current_stage)
-        if not os.path.exists(mdp_path):
+        mdp_path = _resolve_mdp_file(charmm_dir, current_stage, charmm_mtime)
+        if os.path.basename(mdp_path) not in present and not os.path.exists(mdp_path):
             errors.append(f"MDP file not found for {current_stage} stage")
     except Exception as e:
         errors.append(f"MDP file error: {str(e)}")
     
     return errors
 
+# Read-only host state: cache_resource hands back the stored objects as-is
+# (no pickling/copying per rerun, unlike cache_data) and shares them between
+# sessions; the hourly ttl still picks up a newly installed tool or driver.
+@st.cache_resource(ttl=3600, show_spinner=False)
+def _cached_cpu_info():
+    """CPU core count, probed once per hour instead of every rerun"""
+    return cpu_info()
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def _cached_gpu_info():
+    """GPU list, probed once per hour (avoids nvidia-smi/rocm-smi/lspci per rerun)"""
+    return gpu_info()
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def _cached_mmpbsa_installed():
+    """gmx_MMPBSA availability, probed once per hour"""
+    return check_mmpbsa_installed()
+
 # --------------------------------------------------
 # System info
 # --------------------------------------------------
 try:
-    cpus = cpu_info()
-    gpus = gpu_info()
+    cpus = _cached_cpu_info()
+    gpus = _cached_gpu_info()
 except Exception as e:
     st.error(f"Error detecting system info: {e}")
     cpus = 1
     gpus = []
 
+mmpbsa_installed = _cached_mmpbsa_installed()
+
+# Pick up worker output before rendering so the page below is current
+drain_log_queue()
+
+# Filled in by the tabs and redrawn in place while a job is in progress
+_progress_placeholder = _info_placeholder = _log_placeholder = None
+_analysis_progress_placeholder = _analysis_log_placeholder = None
+
 # --------------------------------------------------
 # Sidebar
 # --------------------------------------------------
@@ -141,6 +735,8 @@ if gpus:
     st.sidebar.success(f"GPU detected: {gpus[0]}")
 else:
     st.sidebar.info("No GPU detected")
+if not mmpbsa_installed:
+    st.sidebar.warning("gmx_MMPBSA not found in PATH")
 
 # Sidebar navigation
 st.sidebar.header("Navigation")
@@ -167,130 +763,111 @@ charmm_dir = st.text_input(
     help="Path to the GROMACS directory from CHARMM-GUI"
 )
 
+# One cached scandir pass answers every "does X exist" check below and
+# also supplies the root md_run_*.log listing
+charmm_mtime = _dir_mtime(charmm_dir) if charmm_dir else 0
+charmm_dir_valid = bool(charmm_mtime)
+charmm_files, charmm_logs = (
+    _scan_dir(charmm_dir, charmm_mtime) if charmm_dir_valid else (set(), [])
+)
+
 # ────────────────────────────────────────────────
 # Auto-detect completed production from files
 # (put this right here – after directory input)
 # ────────────────────────────────────────────────
-if charmm_dir and os.path.isdir(charmm_dir):
-    md_gro_path = os.path.join(charmm_dir, "md.gro")
-    md_xtc_path = os.path.join(charmm_dir, "md.xtc")
-    md_tpr_path = os.path.join(charmm_dir, "md.tpr")
-
-    if all(os.path.exists(p) for p in [md_gro_path, md_xtc_path, md_tpr_path]):
+if charmm_dir_valid:
+    if {"md.gro", "md.xtc", "md.tpr"} <= charmm_files:
         log_path = os.path.join(charmm_dir, "md.log")
         finished_detected = False
         
-        if os.path.exists(log_path):
-            try:
-                with open(log_path, 'r') as f:
-                    last_lines = f.readlines()[-30:]  # last 30 lines for safety
-                if any("Finished" in line or "Finished writing" in line or "Finished mdrun" in line for line in last_lines):
-                    finished_detected = True
-            except Exception:
-                pass  # silent fail – don't crash app
+        if "md.log" in charmm_files:
+            # Only the end of md.log matters, however large it has grown;
+            # rescanned only when the log changes
+            log_key = _file_key(log_path)
+            finished_detected = bool(log_key) and _log_finished(log_path, log_key)
 
         # If files exist and log looks finished → mark as done
         if finished_detected and not st.session_state.finished:
-            with _state_lock:
-                st.session_state.finished = True
-                st.session_state.progress = 100
-                # Optional: also set stage if you want
-                # st.session_state.current_stage = "production"
+            st.session_state.finished = True
+            st.session_state.progress = 100
+            # Optional: also set stage if you want
+            # st.session_state.current_stage = "production"
             st.success("✅ Automatically detected completed production run from files!")
 
 if tab == "MD Simulation":
     # Auto-detect files in the directory
-    if charmm_dir and os.path.isdir(charmm_dir):
+    if charmm_dir_valid:
         st.markdown("### 📁 Input Files in Directory")
         
-        required_files = [
-            "step3_input.gro",
-            "step3_input.pdb",
-            "step4_0_minimization.mdp",
-            "step4.1_equilibration.mdp",
-            "step4_equilibration.mdp",
-            "step5_production.mdp",
-            "topol.top"
-        ]
-        
-        found_files = {}
-        for fname in required_files:
-            fpath = os.path.join(charmm_dir, fname)
-            if os.path.isfile(fpath):
-                found_files[fname] = fpath
-        
+        found_files = {
+            fname: os.path.join(charmm_dir, fname)
+            for fname in MD_INPUT_FILES
+            if fname in charmm_files
+        }
+
         if found_files:
-            cols = st.columns([3, 1])
-            with cols[0]:
-                st.write("**Found Files:**")
-            with cols[1]:
-                st.write("**Action**")
-            
-            for fname, fpath in found_files.items():
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.write(f"✅ {fname}")
-                with col2:
-                    if st.button("View", key=f"view_{fname}"):
-                        try:
-                            content = safe_read_file(fpath)
-                            with st.expander(f"📄 {fname}", expanded=False):
-                                st.code(content, language="text")
-                        except ValueError as e:
-                            st.error(str(e))
-                        except Exception as e:
-                            st.error(f"Error reading file: {e}")
+            # One element for the whole list rather than one per file
+            st.markdown("**Found Files:**  \n" + "  \n".join(f"✅ {fname}" for fname in found_files))
+
+            # One selector instead of a View button per file
+            selected = st.selectbox(
+                "View file",
+                list(found_files),
+                index=None,
+                placeholder="Select a file to view",
+                key="view_file"
+            )
+            if selected:
+                try:
+                    with st.expander(f"📄 {selected}", expanded=False):
+                        show_file(found_files[selected], key="view_file_content")
+                except ValueError as e:
+                    st.error(str(e))
+                except Exception as e:
+                    st.error(f"Error reading file: {e}")
         else:
             st.warning("⚠️ No GROMACS files found in this directory")
         
         # Display log files section
         st.markdown("### 📋 Generated Log Files")
         
-        # Look in both root and logs subdirectory
-        log_patterns = [
-            os.path.join(charmm_dir, "md_run_*.log"),
-            os.path.join(charmm_dir, "logs", "*.log")
+        # md_run_*.log from the root snapshot, plus everything in logs/
+        logs_dir = os.path.join(charmm_dir, "logs")
+        log_files = [
+            entry for entry in charmm_logs
+            if os.path.basename(entry[0]).startswith("md_run_")
         ]
-        
-        log_files = []
-        for pattern in log_patterns:
-            log_files.extend(glob.glob(pattern))
-        
-        # Remove duplicates and sort by modification time (newest first)
-        log_files = sorted(
-            list(set(log_files)), 
-            key=lambda x: os.path.getmtime(x) if os.path.exists(x) else 0, 
-            reverse=True
-        )
-        
+        log_files += _scan_dir(logs_dir, _dir_mtime(logs_dir))[1]
+
+        # Newest first; partial sort since only the top few are shown
+        log_files = heapq.nlargest(MAX_LOG_FILES_SHOWN, log_files, key=lambda x: x[2])
+
         if log_files:
-            cols = st.columns([3, 1])
-            with cols[0]:
-                st.write("**Log Files:**")
-            with cols[1]:
-                st.write("**Action**")
-            
-            for log_file in log_files[:10]:  # Show last 10 log files
-                fname = os.path.basename(log_file)
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    # Show file size and modification time
-                    try:
-                        size_kb = os.path.getsize(log_file) / 1024
-                        mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(os.path.getmtime(log_file)))
-                        st.write(f"📄 {fname} ({size_kb:.1f} KB, {mtime})")
-                    except Exception:
-                        st.write(f"📄 {fname}")
-                with col2:
-                    if st.button("View", key=f"view_log_{fname}"):
-                        try:
-                            content = safe_read_file(log_file)
-                            with st.expander(f"📋 {fname}", expanded=False):
-                                st.text_area("Log Content", value=content, height=300, disabled=True, key=f"log_content_{fname}")
-                        except ValueError as e:
-                            st.error(str(e))
-                        except Exception as e:
-                            st.error(f"Error reading log file: {e}")
+            # Show file size and modification time, one element for the list
+            st.markdown("**Log Files:**  \n" + "  \n".join(
+                f"📄 {os.path.basename(log_file)} ({size / 1024:.1f} KB, "
+                f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))})"
+                for log_file, size, mtime in log_files
+            ))
+
+            selected_log = st.selectbox(
+                "View log file",
+                [log_file for log_file, _, _ in log_files],
+                index=None,
+                format_func=os.path.basename,
+                placeholder="Select a log file to view",
+                key="view_log_file"
+            )
+            if selected_log:
+                fname = os.path.basename(selected_log)
+                try:
+                    content = read_file_cached(selected_log, tail_bytes=LOG_TAIL_BYTES)
+                    with st.expander(f"📋 {fname}", expanded=False):
+                        st.text_area("Log Content", value=content, height=300, disabled=True, key="log_content")
+                except ValueError as e:
+                    st.error(str(e))
+                except Exception as e:
+                    st.error(f"Error reading log file: {e}")
         else:
             st.info("ℹ️ No log files yet. Run a simulation to generate logs.")
         
@@ -308,11 +885,9 @@ if tab == "MD Simulation":
     st.markdown("### 🎯 Simulation Stage")
 
     # Auto-detect setup completion from files
-    if charmm_dir and os.path.isdir(charmm_dir):
-        setup_output = os.path.join(charmm_dir, "setup.gro")
-        if os.path.exists(setup_output) and not st.session_state.setup_completed:
-            st.session_state.setup_completed = True
-            st.success("✅ Setup output detected - all stages unlocked!")
+    if "setup.gro" in charmm_files and not st.session_state.setup_completed:
+        st.session_state.setup_completed = True
+        st.success("✅ Setup output detected - all stages unlocked!")
 
     col1, col2 = st.columns([2, 3])
 
@@ -333,12 +908,7 @@ if tab == "MD Simulation":
         st.session_state.current_stage = stage.lower()
 
     with col2:
-        stage_info = {
-            "setup": "🔧 Initialize system, run energy minimization",
-            "equilibration": "🌡️ Warm up system, equilibrate temperature & pressure",
-            "production": "🎬 Collect production MD data for analysis"
-        }
-        st.markdown(f"**{stage_info.get(st.session_state.current_stage, '')}**")
+        st.markdown(f"**{STAGE_INFO.get(st.session_state.current_stage, '')}**")
 
     run_mode = st.radio(
         "Run mode",
@@ -361,30 +931,47 @@ if tab == "MD Simulation":
     # --------------------------------------------------
     # Callbacks (thread safe)
     # --------------------------------------------------
-    def log_callback(line):
-        """Add log line to queue (thread-safe)"""
+    # Captured here, on the script thread, so the worker's callbacks touch
+    # only deques and an Event, never the session_state proxy
+    log_queue = st.session_state.log_queue
+    log_evicted = st.session_state.log_evicted
+    progress_slot = st.session_state.progress_slot
+    pid_slot = st.session_state.pid_slot
+    update_event = st.session_state.update_event
+
+    def log_callback(text):
+        """Queue an output batch (thread-safe); evict the oldest when full"""
         try:
-            st.session_state.log_queue.put(line)
+            log_queue.append(text)
+            if len(log_queue) > LOG_QUEUE_MAX_BATCHES:
+                try:
+                    oldest = log_queue.popleft()
+                except IndexError:
+                    pass  # the script drained it meanwhile
+                else:
+                    log_evicted.append(len(oldest.splitlines()))
+            update_event.set()
         except Exception:
             pass  # Silently ignore queue errors
 
     def progress_callback(step, total):
-        """Update progress (thread-safe)"""
+        """Publish progress; replaces any value the script hasn't read yet"""
         if total > 0:
-            with _state_lock:
-                st.session_state.progress = int((step / total) * 100)
+            progress_slot.append(int((step / total) * 100))
+            update_event.set()
 
     def pid_callback(pid):
-        """Store process PID (thread-safe)"""
-        with _state_lock:
-            st.session_state.md_pid = pid
+        """Publish the mdrun PID; drain_log_queue moves it into md_pid"""
+        pid_slot.append(pid)
+        update_event.set()
 
     # --------------------------------------------------
     # Background runner
     # --------------------------------------------------
     def run_job(gromacs_dir_param, use_gpu_param, threads_param, total_steps_param, stage_param, resume=False):
         """
-        Run MD simulation in background thread
+        Run MD simulation in background thread. Returns (stage, exit code);
+        drain_log_queue applies the outcome once the future is done.
         """
         try:
             result = run_md(
@@ -396,42 +983,22 @@ if tab == "MD Simulation":
                 log_callback=log_callback,
                 progress_callback=progress_callback,
                 pid_callback=pid_callback,
-                stage=stage_param
+                stage=stage_param,
+                chunked=True  # one queue append per read batch; split in drain_log_queue
             )
-
-            with _state_lock:
-                # force completion state
-                st.session_state.progress = 100
-                st.session_state.running = False
-                st.session_state.paused = False
-                st.session_state.finished = True
-                st.session_state.md_pid = None
-
-                # unlock next stages
-                if stage_param == "setup" and result == 0:
-                    st.session_state.setup_completed = True
-                    log_callback("__SETUP_COMPLETED__")
-                    log_callback("\n✅ Setup stage completed! You can now run Equilibration and Production.\n")
-
-        except Exception as e:
-            error_msg = f"\n❌ Error: {str(e)}\n"
-            with _state_lock:
-                st.session_state.error = str(e)
-                st.session_state.running = False
-                st.session_state.paused = False
-                st.session_state.finished = False
-                st.session_state.md_pid = None
-            log_callback(error_msg)
+            return stage_param, result
+        finally:
+            update_event.set()
 
     # Control buttons
     col1, col2, col3 = st.columns(3)
 
     run_disabled = st.session_state.running
-    if st.session_state.current_stage in ["equilibration", "production"] and not st.session_state.setup_completed:
+    if st.session_state.current_stage in GATED_STAGES and not st.session_state.setup_completed:
         run_disabled = True
 
     with col1:
-        if run_disabled and st.session_state.current_stage in ["equilibration", "production"]:
+        if run_disabled and st.session_state.current_stage in GATED_STAGES:
             st.button("▶ Run MD", disabled=True, help="Complete Setup stage first")
             st.caption("⚠️ Complete Setup first")
         else:
@@ -445,17 +1012,31 @@ if tab == "MD Simulation":
                         st.error(f"❌ {error}")
                 else:
                     try:
-                        mdp_path = get_mdp_file(charmm_dir, st.session_state.current_stage)
-                        nsteps = update_mdp_nsteps(mdp_path, ns)
-
-                        with _state_lock:
-                            st.session_state.total_steps = nsteps
-                            st.session_state.running = True
-                            st.session_state.finished = False
-                            st.session_state.paused = False
-                            st.session_state.error = None
-                            st.session_state.logs.clear()
-                            st.session_state.progress = 0
+                        mdp_path = _resolve_mdp_file(
+                            charmm_dir, st.session_state.current_stage, charmm_mtime
+                        )
+                        nsteps = apply_mdp_nsteps(mdp_path, ns)
+
+                        st.session_state.total_steps = nsteps
+                        st.session_state.last_log_file = os.path.join(
+                            charmm_dir,
+                            f"{STAGE_OUTPUT_PREFIX.get(st.session_state.current_stage, 'md')}.log"
+                        )
+                        st.session_state.running = True
+                        st.session_state.finished = False
+                        st.session_state.paused = False
+                        st.session_state.pause_requested = False
+                        st.session_state.pause_failed = False
+                        st.session_state.md_pid = None
+                        st.session_state.pid_slot.clear()
+                        st.session_state.error = None
+                        st.session_state.logs.clear()
+                        st.session_state.logs_joined = ""
+                        st.session_state.logs_dropped = 0
+                        st.session_state.log_evicted.clear()
+                        st.session_state.progress = 0
+                        st.session_state.progress_slot.clear()
+                        st.session_state.completion_celebrated = False
 
                         use_gpu = run_mode.startswith("GPU")
                         if st.session_state.current_stage == "setup":
@@ -463,20 +1044,15 @@ if tab == "MD Simulation":
                                 st.warning("⚠️ GPU disabled for Setup stage. Using CPU only.")
                             use_gpu = False
                         
-                        thread = threading.Thread(
-                            target=run_job,
-                            kwargs={
-                                "gromacs_dir_param": charmm_dir,
-                                "use_gpu_param": use_gpu,
-                                "threads_param": threads,
-                                "total_steps_param": nsteps,
-                                "stage_param": st.session_state.current_stage,
-                                "resume": False
-                            },
-                            daemon=False
+                        st.session_state.md_future = st.session_state.job_executor.submit(
+                            run_job,
+                            gromacs_dir_param=charmm_dir,
+                            use_gpu_param=use_gpu,
+                            threads_param=threads,
+                            total_steps_param=nsteps,
+                            stage_param=st.session_state.current_stage,
+                            resume=False
                         )
-                        thread.start()
-                        st.session_state.md_thread = thread
                         
                         st.rerun()
                         
@@ -485,69 +1061,69 @@ if tab == "MD Simulation":
 
     with col2:
         if st.button("⏸ Pause", disabled=not st.session_state.running, help="Pause the simulation"):
-            success = stop_md(st.session_state.md_pid)
-            with _state_lock:
-                st.session_state.running = False
-                st.session_state.paused = True
-            
-            if success:
-                st.warning("⏸ MD paused (checkpoint saved)")
-            else:
-                st.error("❌ Failed to pause simulation")
+            # stop_md can wait several seconds for mdrun to exit; don't block the UI on it
+            st.session_state.stop_future = get_control_executor().submit(stop_md, st.session_state.md_pid)
+            st.session_state.stop_future.add_done_callback(lambda _: update_event.set())
+            st.session_state.running = False
+            st.session_state.paused = True
+            st.session_state.pause_requested = True
+            st.session_state.pause_failed = False
+
+        # drain_log_queue resolves stop_future, whichever tab is shown
+        if st.session_state.stop_future is not None:
+            st.info("⏸ Pausing...")
+        elif st.session_state.paused:
+            st.warning("⏸ MD paused (checkpoint saved)")
+        elif st.session_state.pause_failed:
+            st.error("❌ Failed to pause simulation")
 
     with col3:
-        if st.button("▶ Resume", disabled=st.session_state.running or not st.session_state.paused, help="Resume the paused simulation"):
-            with _state_lock:
-                st.session_state.running = True
-                st.session_state.error = None
-                st.session_state.paused = False
-
-            thread = threading.Thread(
-                target=run_job,
-                kwargs={
-                    "gromacs_dir_param": charmm_dir,
-                    "use_gpu_param": run_mode.startswith("GPU"),
-                    "threads_param": threads,
-                    "total_steps_param": st.session_state.total_steps,
-                    "stage_param": st.session_state.current_stage,
-                    "resume": True
-                },
-                daemon=False
+        # Resume only once the paused run has actually exited, so two mdruns
+        # never share the directory
+        resume_disabled = (
+            st.session_state.running or not st.session_state.paused
+            or st.session_state.md_future is not None
+        )
+        if st.button("▶ Resume", disabled=resume_disabled, help="Resume the paused simulation"):
+            st.session_state.running = True
+            st.session_state.error = None
+            st.session_state.paused = False
+            st.session_state.pause_requested = False
+            st.session_state.pause_failed = False
+            st.session_state.md_pid = None
+            st.session_state.pid_slot.clear()
+
+            st.session_state.md_future = st.session_state.job_executor.submit(
+                run_job,
+                gromacs_dir_param=charmm_dir,
+                use_gpu_param=run_mode.startswith("GPU"),
+                threads_param=threads,
+                total_steps_param=st.session_state.total_steps,
+                stage_param=st.session_state.current_stage,
+                resume=True
             )
-            thread.start()
-            st.session_state.md_thread = thread
             
             st.rerun()
 
     # Progress bar + status
-    st.progress(st.session_state.progress / 100.0 if st.session_state.progress <= 100 else 1.0)
-
-    status_emoji = {
-        "running": "🟢",
-        "paused": "⏸",
-        "finished": "✅",
-        "idle": "⏹"
-    }
+    _progress_placeholder = st.empty()
 
     if st.session_state.running:
-        status = f"{status_emoji['running']} Running"
+        status = f"{STATUS_EMOJI['running']} Running"
     elif st.session_state.paused:
-        status = f"{status_emoji['paused']} Paused"
+        status = f"{STATUS_EMOJI['paused']} Paused"
     elif st.session_state.finished:
-        status = f"{status_emoji['finished']} Finished"
+        status = f"{STATUS_EMOJI['finished']} Finished"
     else:
-        status = f"{status_emoji['idle']} Idle"
+        status = f"{STATUS_EMOJI['idle']} Idle"
 
     st.markdown(f"**Status:** {status}")
 
     if st.session_state.setup_completed:
         st.success("✅ Setup completed - Equilibration & Production unlocked")
 
-    st.info(
-        f"📌 Current Stage: **{st.session_state.current_stage.capitalize()}** | "
-        f"Total steps: **{st.session_state.total_steps:,}** | "
-        f"Progress: **{st.session_state.progress}%**"
-    )
+    _info_placeholder = st.empty()
+    render_progress(_progress_placeholder, _info_placeholder)
 
     # View log toggle
     col1, col2, col3 = st.columns(3)
@@ -562,23 +1138,15 @@ if tab == "MD Simulation":
     with col3:
         if st.session_state.error:
             if st.button("🗑️ Clear error", help="Clear the error message"):
-                with _state_lock:
-                    st.session_state.error = None
+                st.session_state.error = None
                 st.rerun()
 
     # Terminal-style log viewer
     should_show_logs = st.session_state.show_logs or st.session_state.running
 
-    if should_show_logs and st.session_state.logs:
-        st.markdown("### 🖥 MD Run Log")
-        log_content = "".join(st.session_state.logs)
-        st.text_area(
-            "MD Run Log",
-            value=log_content,
-            height=400,
-            label_visibility="collapsed",
-            key="log_display"
-        )
+    if should_show_logs:
+        _log_placeholder = st.empty()
+        render_log(_log_placeholder)
 
     # Errors / success
     if st.session_state.error:
@@ -586,7 +1154,9 @@ if tab == "MD Simulation":
 
     if st.session_state.finished and not st.session_state.error:
         st.success("✅ MD simulation completed successfully!")
-        st.balloons()
+        if not st.session_state.completion_celebrated:
+            st.session_state.completion_celebrated = True
+            st.balloons()
 
 elif tab == "MMPBSA Analysis":
 
@@ -602,54 +1172,54 @@ elif tab == "MMPBSA Analysis":
         key="mmpbsa_analysis_dir"
     )
 
-    if not analysis_dir or not os.path.isdir(analysis_dir):
+    # Defaults to the GROMACS directory, which was already stat'ed this run
+    if analysis_dir == charmm_dir:
+        analysis_mtime = charmm_mtime
+    else:
+        analysis_mtime = _dir_mtime(analysis_dir) if analysis_dir else 0
+    if not analysis_mtime:
         st.error("Please enter a valid directory path.")
     else:
+        # One cached scandir pass answers the presence checks below
+        analysis_files, _ = _scan_dir(analysis_dir, analysis_mtime)
+
         # ────────────────────────────────────────────────
         # Input Files in Directory (same style as MD tab)
         # ────────────────────────────────────────────────
         st.markdown("### 📁 Input Files in Directory")
 
-        display_files = [
-            "md.tpr", "md.xtc", "index.ndx", "topol.top",
-            "mmpbsa.in", "md.gro", "md.log", "md.edr", "md.cpt"
-        ]
-
-        required_files_list = [
-            "md.tpr", "md.xtc", "index.ndx", "topol.top", "mmpbsa.in"
-        ]
-
-        found_files = {}
-        for fname in display_files:
-            fpath = os.path.join(analysis_dir, fname)
-            if os.path.isfile(fpath):
-                found_files[fname] = fpath
+        found_files = {
+            fname: os.path.join(analysis_dir, fname)
+            for fname in MMPBSA_DISPLAY_FILES
+            if fname in analysis_files
+        }
 
-        required_found = sum(1 for f in required_files_list if os.path.exists(os.path.join(analysis_dir, f)))
-        total_required = len(required_files_list)
-        missing_required = [f for f in required_files_list if not os.path.exists(os.path.join(analysis_dir, f))]
+        missing_required = [f for f in MMPBSA_REQUIRED_FILES if f not in analysis_files]
+        total_required = len(MMPBSA_REQUIRED_FILES)
+        required_found = total_required - len(missing_required)
 
         if found_files:
-            cols = st.columns([3, 1])
-            with cols[0]:
-                st.markdown("**Found Files:**")
-            with cols[1]:
-                st.markdown("**Action**")
-
-            for fname, fpath in found_files.items():
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.write(f"✅ {fname}")
-                with col2:
-                    if st.button("View", key=f"mmpbsa_view_{fname}"):
-                        try:
-                            content = safe_read_file(fpath)
-                            with st.expander(f"📄 {fname}", expanded=False):
-                                st.code(content, language="text")
-                        except ValueError as e:
-                            st.error(str(e))
-                        except Exception as e:
-                            st.error(f"Error reading file: {e}")
+            st.markdown("**Found Files:**  \n" + "  \n".join(f"✅ {fname}" for fname in found_files))
+
+            selected = st.selectbox(
+                "View file",
+                list(found_files),
+                index=None,
+                placeholder="Select a file to view",
+                key="mmpbsa_view_file"
+            )
+            if selected:
+                try:
+                    with st.expander(f"📄 {selected}", expanded=False):
+                        if selected.endswith(".log"):
+                            content = read_file_cached(found_files[selected], tail_bytes=LOG_TAIL_BYTES)
+                            st.code(content, language="text")
+                        else:
+                            show_file(found_files[selected], key="mmpbsa_view_file_content")
+                except ValueError as e:
+                    st.error(str(e))
+                except Exception as e:
+                    st.error(f"Error reading file: {e}")
         else:
             st.warning("⚠️ No relevant files found in this directory.")
 
@@ -673,33 +1243,26 @@ elif tab == "MMPBSA Analysis":
 
         info_container = st.container()
 
-        if os.path.exists(xtc_path) and os.path.exists(tpr_path):
+        xtc_key = _file_key(xtc_path)
+        tpr_key = _file_key(tpr_path)
+
+        if xtc_key and tpr_key:
             try:
+                # Cached until the trajectory or run input changes
+                (ok, frames), (atoms_ok, natoms) = _gmx_introspect(xtc_path, xtc_key, tpr_path, tpr_key)
+
                 # Number of frames
-                result = subprocess.run(
-                    ["gmx", "check", "-f", xtc_path],
-                    capture_output=True, text=True, timeout=15, check=False
-                )
-                if result.returncode == 0:
-                    output = result.stdout + result.stderr
-                    frames_match = re.search(r"Found\s+(\d+)\s+frames", output)
-                    if frames_match:
-                        info_container.success(f"**Total frames in trajectory:** {frames_match.group(1)}")
+                if ok:
+                    if frames is not None:
+                        info_container.success(f"**Total frames in trajectory:** {frames}")
                 else:
                     info_container.warning("gmx check failed – check GROMACS installation")
 
                 # Number of atoms
-                result2 = subprocess.run(
-                    ["gmx", "dump", "-s", tpr_path],
-                    capture_output=True, text=True, timeout=20, check=False
-                )
-                if result2.returncode == 0:
-                    atoms_match = re.search(r"natoms\s*=\s*(\d+)", result2.stdout)
-                    if atoms_match:
-                        natoms = int(atoms_match.group(1))
-                        natoms_display = f"{natoms:,}"  # safe comma formatting
-                        info_container.info(f"**Number of atoms:** {natoms_display}")
-                else:
+                if natoms is not None:
+                    natoms_display = f"{natoms:,}"  # safe comma formatting
+                    info_container.info(f"**Number of atoms:** {natoms_display}")
+                elif not atoms_ok:
                     info_container.warning("gmx dump failed")
 
             except FileNotFoundError:
@@ -794,31 +1357,17 @@ elif tab == "MMPBSA Analysis":
 
         if st.button("Apply settings & Update mmpbsa.in"):
             mmpbsa_in_path = os.path.join(analysis_dir, "mmpbsa.in")
-            content = f"""&general
-sys_name = "Protein-Ligand",
-startframe = {start_frame},
-endframe = {end_frame},
-interval = {interval},
-verbose = {verbose},
-/
-"""
-
-            if calc_type.startswith("GB"):
-                content += f"""&gb
-igb = 5,
-saltcon = {salt_con},
-/
-"""
-            else:
-                content += f"""&pb
-istrng = {salt_con},
-fillratio = 4.0,
-/
-"""
+            method_template = MMPBSA_IN_GB if calc_type.startswith("GB") else MMPBSA_IN_PB
+            content = (
+                MMPBSA_IN_GENERAL.format(
+                    start_frame=start_frame, end_frame=end_frame,
+                    interval=interval, verbose=verbose
+                )
+                + method_template.format(salt_con=salt_con)
+            )
 
             try:
-                with open(mmpbsa_in_path, "w") as f:
-                    f.write(content)
+                write_mmpbsa_in(mmpbsa_in_path, content)
                 st.success("mmpbsa.in updated successfully!")
             except Exception as e:
                 st.error(f"Failed to update mmpbsa.in: {e}")
@@ -831,7 +1380,8 @@ fillratio = 4.0,
         st.markdown("### Run & Monitor")
 
         # Progress bar
-        st.progress(st.session_state.get("analysis_progress", 0) / 100.0)
+        _analysis_progress_placeholder = st.empty()
+        _analysis_progress_placeholder.progress(st.session_state.analysis_progress / 100.0)
 
         # Status
         if st.session_state.analysis_running:
@@ -847,15 +1397,8 @@ fillratio = 4.0,
 
         # Log display
         if st.session_state.get("show_mmpbsa_logs", False) or st.session_state.analysis_running:
-            if st.session_state.analysis_logs:
-                st.text_area(
-                    "MMPBSA Output Log",
-                    value="\n".join(st.session_state.analysis_logs[-80:]),
-                    height=300,
-                    disabled=True
-                )
-            else:
-                st.info("Waiting for output... (gmx_MMPBSA is preparing files — this can take a while)")
+            _analysis_log_placeholder = st.empty()
+            render_analysis_log(_analysis_log_placeholder)
 
         # ────────────────────────────────────────────────
         # Run Button
@@ -868,73 +1411,90 @@ fillratio = 4.0,
         if st.button("🔬 Run MMPBSA", disabled=disabled, type="primary"):
             mmpbsa_in_path = os.path.join(analysis_dir, "mmpbsa.in")
 
-            with _state_lock:
-                st.session_state.analysis_running = True
-                st.session_state.analysis_finished = False
-                st.session_state.analysis_progress = 0
-                st.session_state.analysis_logs = []
-                st.session_state.error = None
+            st.session_state.analysis_running = True
+            st.session_state.analysis_finished = False
+            st.session_state.analysis_progress = 0
+            st.session_state.analysis_progress_slot.clear()
+            st.session_state.analysis_logs.clear()
+            st.session_state.error = None
+
+            # Captured on the script thread, like the MD callbacks
+            analysis_log_queue = st.session_state.analysis_log_queue
+            analysis_progress_slot = st.session_state.analysis_progress_slot
+            update_event = st.session_state.update_event
 
             def log_cb(msg):
-                if "analysis_log_queue" in st.session_state:
-                    st.session_state.analysis_log_queue.put(msg)
+                analysis_log_queue.append(msg)
+                update_event.set()
 
             def progress_cb(pct):
-                with _state_lock:
-                    st.session_state.analysis_progress = min(100, int(pct))
-
-            def run_thread():
-                try:
-                    run_mmpbsa(
-                        work_dir=analysis_dir,
-                        tpr_file="md.tpr",
-                        trajectory="md.xtc",
-                        index_file="index.ndx",
-                        input_file="mmpbsa.in",
-                        topology_file="topol.top",
-                        receptor_group=rec_group,   # ← CHANGE TO THIS (from None)
-                        ligand_group=lig_group,     # ← CHANGE TO THIS (from None)
-                        n_cores=None,
-                        log_callback=log_cb,
-                        progress_callback=progress_cb
-                    )
-                    with _state_lock:
-                        st.session_state.analysis_running = False
-                        st.session_state.analysis_finished = True
-                        st.session_state.analysis_progress = 100
-                except Exception as e:
-                    with _state_lock:
-                        st.session_state.error = str(e)
-                        st.session_state.analysis_running = False
-
-            thread = threading.Thread(target=run_thread, daemon=False)
-            thread.start()
+                analysis_progress_slot.append(min(100, int(pct)))
+                update_event.set()
+
+            # Outcome is picked up by drain_log_queue once the future is done
+            st.session_state.analysis_future = st.session_state.job_executor.submit(
+                run_mmpbsa,
+                work_dir=analysis_dir,
+                tpr_file="md.tpr",
+                trajectory="md.xtc",
+                index_file="index.ndx",
+                input_file="mmpbsa.in",
+                topology_file="topol.top",
+                receptor_group=rec_group,   # ← CHANGE TO THIS (from None)
+                ligand_group=lig_group,     # ← CHANGE TO THIS (from None)
+                n_cores=None,
+                log_callback=log_cb,
+                progress_callback=progress_cb
+            )
+            st.session_state.analysis_future.add_done_callback(lambda _: update_event.set())
             st.rerun()
 
-# --------------------------------------------------
-# Collect logs (main thread)
-# --------------------------------------------------
-_logs_changed = False
-while not st.session_state.log_queue.empty():
-    line = st.session_state.log_queue.get_nowait()
-    if line.strip() == "__SETUP_COMPLETED__":
-        st.session_state.setup_completed = True
-        _logs_changed = True
-        continue
-    st.session_state.logs.append(line)
-
-if st.session_state.running and st.session_state.md_thread and not st.session_state.md_thread.is_alive():
-    st.session_state.running = False
-    st.session_state.progress = 100
-    st.session_state.finished = True
-    _logs_changed = True
-
-if _logs_changed:
-    st.rerun()
+# State as rendered above
+_rendered_sig = refresh_signature()
 
 # --------------------------------------------------
 # Auto-refresh when running
 # --------------------------------------------------
-if st.session_state.running or st.session_state.analysis_running:
-    time.sleep(2)
-    st.rerun()
\ No newline at end of file
+if (
+    st.session_state.running or st.session_state.analysis_running
+    or st.session_state.stop_future or st.session_state.md_future
+):
+    # Edge-triggered refresh: wake as soon as a worker signals new output,
+    # progress or completion, and re-check periodically otherwise. Progress
+    # and log lines are redrawn in place; only a change in run state needs
+    # a full rerun.
+    _heartbeat = st.empty()
+    _last_redraw = time.monotonic()
+    _drawn = (
+        st.session_state.progress, st.session_state.log_seq,
+        st.session_state.analysis_progress, st.session_state.analysis_log_seq
+    )
+    while True:
+        _heartbeat.empty()  # any st call lets Streamlit interrupt the wait for user input
+        if st.session_state.update_event.wait(timeout=REFRESH_INTERVAL):
+            # Rate-limit instead of always delaying: an update after a quiet
+            # spell is shown at once, a burst gets one redraw per interval
+            _since_redraw = time.monotonic() - _last_redraw
+            if _since_redraw < MIN_REFRESH_INTERVAL:
+                time.sleep(MIN_REFRESH_INTERVAL - _since_redraw)
+        st.session_state.update_event.clear()
+
+        if drain_log_queue() or refresh_signature() != _rendered_sig:
+            break
+
+        _current = (
+            st.session_state.progress, st.session_state.log_seq,
+            st.session_state.analysis_progress, st.session_state.analysis_log_seq
+        )
+        if _current != _drawn:
+            if _progress_placeholder is not None and _current[0] != _drawn[0]:
+                render_progress(_progress_placeholder, _info_placeholder)
+            if _log_placeholder is not None and _current[1] != _drawn[1]:
+                render_log(_log_placeholder)
+            if _analysis_progress_placeholder is not None and _current[2] != _drawn[2]:
+                _analysis_progress_placeholder.progress(st.session_state.analysis_progress / 100.0)
+            if _analysis_log_placeholder is not None and _current[3] != _drawn[3]:
+                render_analysis_log(_analysis_log_placeholder)
+            _drawn = _current
+            _last_redraw = time.monotonic()
+    st.rerun()
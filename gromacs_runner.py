@@ -7,53 +7,384 @@ import subprocess
 import os
 import signal
 import re
+import selectors
+import shutil
 import sys
 import time
 import multiprocessing
+import queue
+import concurrent.futures
+import hashlib
 from datetime import datetime
 
+import psutil
 
+from mdp_utils import read_mdp_parameter
 
+# Run log writes: buffer size, and how often buffered mdrun output is flushed
+LOG_WRITE_BUFFER = 64 * 1024
+LOG_FLUSH_LINES = 256
+LOG_FLUSH_INTERVAL = 2.0  # seconds
+
+# Process output monitoring: bytes per read, and how long to wait for
+# output before calling the idle hook
+OUTPUT_READ_SIZE = 64 * 1024
+OUTPUT_POLL_INTERVAL = 0.5  # seconds
+
+# grompp is stopped only if it prints nothing for this long; large systems
+# can legitimately take longer than that overall
+GROMPP_IDLE_TIMEOUT = 600  # seconds
+
+# stop_md: how long to wait for mdrun to die after SIGKILL, and the poll
+# interval range used where pidfd_open is not available (doubling from the
+# first value to the second)
+STOP_KILL_TIMEOUT = 2.0  # seconds
+STOP_POLL_INTERVAL = (0.01, 0.5)  # seconds
+
+# mdrun output patterns, compiled once and applied to every output line
+# One scan finds both progress forms; match.lastgroup says which matched:
+#   step: "Step 100" (MD) or "Step=100" (minimization)
+#   pct:  percentage progress printed by setup/preprocessing
+# (horizontal whitespace only: patterns also run over multi-line batches)
+_PROGRESS_RE = re.compile(
+    r"Step(?:[ \t]*=[ \t]*|[ \t]+)(?P<step>\d+)|(?P<pct>\d+(?:\.\d+)?)[ \t]*%",
+    re.IGNORECASE
+)
+_ERROR_RE = re.compile(
+    r"Fatal error|Segmentation fault|ERROR:|Error termination|gmx.*returned non-zero",
+    re.IGNORECASE
+)
+
+# Stage completions (lowercase), each worth an equal share of progress
+MMPBSA_STAGE_MARKERS = (
+    "building amber topologies",
+    "preparing trajectories",
+    "running calculations",
+    "parsing results",
+    "completed successfully"
+)
+_MMPBSA_STAGE_INDEX = {marker: i for i, marker in enumerate(MMPBSA_STAGE_MARKERS, 1)}
+# gmx_MMPBSA output lines are classified in one scan; match.lastgroup says
+# which alternative matched:
+#   frac:  frame counters ("Processing frame 10/100")
+#   pct:   progress bars ("50%|#####|")
+#   err:   error messages
+#   stage: stage completion markers (see MMPBSA_STAGE_MARKERS)
+_MMPBSA_LINE_RE = re.compile(
+    r"(?P<frac>\d+\s*/\s*\d+)|(?P<pct>\d+)%"
+    r"|(?P<err>Fatal error|Error:|MMPBSA_Error|Traceback|failed|Cannot find|No such file)"
+    r"|(?P<stage>" + "|".join(re.escape(marker) for marker in MMPBSA_STAGE_MARKERS) + ")",
+    re.IGNORECASE
+)
+# "startframe = 1" etc. in mmpbsa.in, matched on the raw bytes. \b keeps
+# &nmode's nmstartframe/nmendframe/nminterval from matching.
+_MMPBSA_SETTING_RE = re.compile(
+    rb"\b(startframe|endframe|interval)\s*=\s*(\d+)", re.IGNORECASE
+)
+
+
+def _normalize_output(data):
+    """Treat \r\n and \r like \n in raw output (as text-mode pipes do)"""
+    return data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+def _decode_output(data):
+    """
+    Decode a block of raw output in one call and split it into lines ending
+    in "\n"; the text after the last newline is returned separately
+    """
+    *lines, partial = data.decode("utf-8", errors="replace").split("\n")
+    return [line + "\n" for line in lines], partial
+
+def _iter_output_batches(process, on_idle=None):
+    """
+    Yield lists of decoded output lines from a process started with a binary
+    stdout pipe, one list per chunk read, using a selector instead of
+    blocking on readline(). on_idle is called each time no output arrives
+    for OUTPUT_POLL_INTERVAL seconds, so the caller can do periodic work
+    while the process is quiet.
+
+    The process itself is watched too (through a pidfd, where available):
+    once it has exited and its output is drained, iteration ends even if a
+    leftover child (e.g. an MPI helper) still holds the pipe open.
+    """
+    fd = process.stdout.fileno()
+    os.set_blocking(fd, False)
+    pending = b""
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        pidfd = None
+    exited = False
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ)
+        try:
+            while True:
+                # After exit, only drain what is already buffered
+                events = selector.select(timeout=0 if exited else OUTPUT_POLL_INTERVAL)
+                if not events:
+                    if exited:
+                        break
+                    if on_idle is not None:
+                        on_idle()
+                    continue
+                if pidfd is not None and any(key.fd == pidfd for key, _ in events):
+                    # Everything it wrote is already in the pipe
+                    selector.unregister(pidfd)
+                    exited = True
+                try:
+                    chunk = os.read(fd, OUTPUT_READ_SIZE)
+                except BlockingIOError:
+                    if exited:
+                        break
+                    continue
+                if not chunk:
+                    break
+                pending += chunk
+                # Hold back a trailing \r until we know whether \n follows it
+                cut = len(pending) - 1 if pending.endswith(b"\r") else len(pending)
+                # Complete lines are decoded together, not one by one (a
+                # newline byte never falls inside a UTF-8 sequence)
+                data = _normalize_output(pending[:cut])
+                end = data.rfind(b"\n") + 1
+                pending = data[end:] + pending[cut:]
+                if end:
+                    yield _decode_output(data[:end])[0]
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+
+    if pending:
+        batch, partial = _decode_output(_normalize_output(pending))
+        if partial:
+            batch.append(partial)
+        if batch:
+            yield batch
+
+
+# GROMACS command names, in order of preference
+GMX_COMMAND_VARIANTS = ("gmx", "gmx_mpi", "gmx_d", "gromacs")
+
+# GROMACS command found for a given PATH. Only hits are remembered, so a
+# GROMACS installed while the app is running is still picked up.
+_gmx_command_cache = {}
 
 def check_gmx_command():
     """Check if gmx command is available and return the command name"""
+    path_env = os.environ.get("PATH", "")
+    cached = _gmx_command_cache.get(path_env)
+    if cached is not None:
+        return cached
+    
+    gmx_cmd = _probe_gmx_command()
+    if gmx_cmd is not None:
+        _gmx_command_cache[path_env] = gmx_cmd
+    return gmx_cmd
+
+def _probe_gmx_command():
+    """Look up the GROMACS command on PATH (None if not found)"""
+    # In-process PATH walk; no `which` subprocess per candidate
+    for variant in GMX_COMMAND_VARIANTS:
+        if shutil.which(variant):
+            return variant
+    return None
+
+def _parse_cpulist(cpulist):
+    """CPU ids from a sysfs cpulist such as "0-15,32-47" """
+    cpus = set()
+    for part in cpulist.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def _numa_node_count(cpus):
+    """Number of NUMA nodes (sockets, usually) holding any of the given CPUs"""
+    node_root = "/sys/devices/system/node"
     try:
-        result = subprocess.run(
-            ["which", "gmx"], 
-            capture_output=True, 
-            text=True,
-            timeout=5
-        )
-        if result.returncode == 0:
-            return "gmx"
-        
-        # Try alternative GROMACS commands
-        variants = ["gmx_mpi", "gmx_d", "gromacs"]
-        for variant in variants:
-            result = subprocess.run(
-                ["which", variant], 
-                capture_output=True, 
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                return variant
-        
-        return None
-        
-    except subprocess.TimeoutExpired:
-        return None
-    except Exception as e:
-        print(f"Error checking for gmx command: {e}")
-        return None
+        with os.scandir(node_root) as it:
+            nodes = [e.path for e in it if e.name.startswith("node") and e.name[4:].isdigit()]
+    except OSError:
+        return 1
+    count = 0
+    for node in nodes:
+        try:
+            with open(os.path.join(node, "cpulist")) as f:
+                if _parse_cpulist(f.read()) & cpus:
+                    count += 1
+        except (OSError, ValueError):
+            continue
+    return max(1, count)
+
+def _core_groups(cpus):
+    """
+    Group logical CPUs into physical cores (SMT siblings together), in CPU
+    order, from sysfs; each CPU is its own core where topology is unknown
+    """
+    groups = {}
+    for cpu in sorted(cpus):
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                key = min(_parse_cpulist(f.read()))
+        except (OSError, ValueError):
+            key = cpu
+        groups.setdefault(key, []).append(cpu)
+    return list(groups.values())
+
+def _mdrun_thread_flags(threads, use_gpu=False):
+    """
+    mdrun parallelization flags for a single-node run: `threads` OpenMP
+    threads, pinned to cores only when they fill the node. A CPU run that
+    uses every core of a multi-socket node gets one thread-MPI rank per NUMA node, so
+    each rank's threads share a memory controller; otherwise one rank.
+    Returns (flags, env) where env keeps OMP_NUM_THREADS consistent with
+    -ntomp (mdrun refuses to start when they disagree).
+    """
+    try:
+        cpus = os.sched_getaffinity(0)
+    except AttributeError:  # not on Linux
+        cpus = set(range(os.cpu_count() or 1))
+    available = len(cpus)
+    nthreads = max(1, min(int(threads), available))
+
+    # Pin only a run that uses every CPU of the full mask. A partial run
+    # pinned from core 0 would share cores with any other job (another MD
+    # run, MMPBSA ranks); mdrun's "auto" leaves partial runs unpinned, and
+    # within a cpuset/taskset mask it works inside the inherited mask.
+    full_node = available == (os.cpu_count() or available)
+    pin = "on" if full_node and nthreads == available else "auto"
+
+    # GPU runs keep a single rank: PME on the GPU would need a separate
+    # PME rank (-npme) with more than one
+    ntmpi = 1
+    if not use_gpu and nthreads == available:
+        nodes = _numa_node_count(cpus)
+        if nodes > 1 and nthreads % nodes == 0:
+            ntmpi = nodes
+    ntomp = nthreads // ntmpi
 
-def validate_environment(gromacs_dir, stage):
+    flags = ["-ntmpi", str(ntmpi), "-ntomp", str(ntomp), "-pin", pin]
+    if pin == "on":
+        flags += ["-pinoffset", "0"]
+    env = dict(os.environ, OMP_NUM_THREADS=str(ntomp))
+    return flags, env
+
+# grompp outputs are kept here by a digest of their inputs, so rerunning an
+# unchanged stage reuses the .tpr instead of preprocessing again
+TPR_CACHE_DIR = ".tpr_cache"
+_TOP_INCLUDE_RE = re.compile(rb'^[ \t]*#include[ \t]+"([^"]+)"', re.MULTILINE)
+
+def _grompp_digest(gromacs_dir, grompp_cmd, input_files):
+    """
+    BLAKE2b digest of everything grompp reads: the command line, the
+    contents of the input files, and the size/mtime of every file the
+    topology #includes, directly or through other includes (force-field
+    .itp files can be large, so only their stat is hashed).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update("\0".join(grompp_cmd).encode())
+    for name in input_files:
+        path = os.path.join(gromacs_dir, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        h.update(b"\0" + name.encode() + b"\0")
+        h.update(data)
+        if name.endswith(".top"):
+            _hash_includes(h, gromacs_dir, path, data)
+    return h.hexdigest()
+
+def _hash_includes(h, gromacs_dir, top_path, top_data):
+    """
+    Add the size/mtime of every file reachable through #include from the
+    topology to h, depth-first in include order. Like grompp, a relative
+    include is looked up next to the including file, then in the working
+    directory; anything else comes from the GROMACS library and is skipped.
+    """
+    seen = {os.path.realpath(top_path)}
+    stack = [(os.path.dirname(top_path), _TOP_INCLUDE_RE.findall(top_data)[::-1])]
+    while stack:
+        base_dir, pending = stack[-1]
+        if not pending:
+            stack.pop()
+            continue
+        include = pending.pop()
+        name = os.fsdecode(include)
+        for candidate in (os.path.join(base_dir, name), os.path.join(gromacs_dir, name)):
+            try:
+                st = os.stat(candidate)
+                break
+            except OSError:
+                continue
+        else:
+            continue  # resolved from the GROMACS library instead
+        real = os.path.realpath(candidate)
+        if real in seen:
+            continue
+        seen.add(real)
+        h.update(b"\0%s:%d:%d" % (include, st.st_size, st.st_mtime_ns))
+        try:
+            with open(candidate, "rb") as f:
+                nested = _TOP_INCLUDE_RE.findall(f.read())
+        except OSError:
+            continue
+        if nested:
+            stack.append((os.path.dirname(candidate), nested[::-1]))
+
+def _evict_tpr_cache(tpr_cache_dir, output_prefix, keep):
+    """
+    Drop every cached .tpr for output_prefix except keep, the newest. Each
+    new simulation length is a new digest, so the cache would otherwise
+    grow by a full .tpr per run; the kept entry shares its inode with the
+    live {output_prefix}.tpr and costs no extra space.
+    """
+    prefix = f"{output_prefix}."
+    with os.scandir(tpr_cache_dir) as it:
+        stale = [
+            entry.path for entry in it
+            if entry.name.startswith(prefix) and entry.name.endswith(".tpr")
+            and entry.path != keep
+            # the digest is hex, so "md." never matches "md.run." entries
+            and "." not in entry.name[len(prefix):-len(".tpr")]
+        ]
+    for path in stale:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def _link_replace(src, dst):
+    """Make dst a hard link to src (a copy across filesystems), atomically"""
+    # Already linked: renaming a link over another link to the same inode
+    # is a no-op that would leave the temporary name behind
+    try:
+        if os.path.samefile(src, dst):
+            return
+    except OSError:
+        pass  # dst doesn't exist yet
+    tmp = f"{dst}.tmp{os.getpid()}"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+def _list_files(gromacs_dir):
+    """Names of the regular files in a directory, from one scandir pass"""
+    try:
+        with os.scandir(gromacs_dir) as it:
+            return {entry.name for entry in it if entry.is_file()}
+    except OSError:
+        return set()
+
+def validate_environment(gromacs_dir, stage, present=None):
     """
     Check if all required files exist for the stage
     
     Args:
         gromacs_dir: Path to GROMACS working directory
         stage: Simulation stage ("setup", "equilibration", "production")
+        present: Names of files in gromacs_dir, if already listed
     
     Raises:
         Exception: If required files are missing
@@ -61,6 +392,9 @@ def validate_environment(gromacs_dir, stage):
     Returns:
         True if validation passes
     """
+    if present is None:
+        present = _list_files(gromacs_dir)
+    
     # Basic required files for all stages
     required_files = ["topol.top"]
     
@@ -70,10 +404,7 @@ def validate_environment(gromacs_dir, stage):
     
     elif stage == "equilibration":
         # Need either setup output or original input
-        setup_gro = os.path.join(gromacs_dir, "setup.gro")
-        original_gro = os.path.join(gromacs_dir, "step3_input.gro")
-        
-        if not os.path.exists(setup_gro) and not os.path.exists(original_gro):
+        if "setup.gro" not in present and "step3_input.gro" not in present:
             raise Exception(
                 "Missing input structure for equilibration. "
                 "Run 'setup' stage first or provide step3_input.gro"
@@ -81,38 +412,43 @@ def validate_environment(gromacs_dir, stage):
     
     elif stage == "production":
         # Need either equilibration output, setup output, or original input
-        equil_gro = os.path.join(gromacs_dir, "equil.gro")
-        setup_gro = os.path.join(gromacs_dir, "setup.gro")
-        original_gro = os.path.join(gromacs_dir, "step3_input.gro")
-        
-        if not any(os.path.exists(f) for f in [equil_gro, setup_gro, original_gro]):
+        if not any(f in present for f in ("equil.gro", "setup.gro", "step3_input.gro")):
             raise Exception(
                 "Missing input structure for production. "
                 "Run 'setup' or 'equilibration' stage first, or provide step3_input.gro"
             )
     
     # Check all required files
-    missing_files = []
-    for file in required_files:
-        if not os.path.exists(os.path.join(gromacs_dir, file)):
-            missing_files.append(file)
+    missing_files = [file for file in required_files if file not in present]
     
     if missing_files:
         raise Exception(f"Missing required files: {', '.join(missing_files)}")
     
     return True
 
-def find_mdp_file(gromacs_dir, stage):
+# MDP file found per (directory, stage, directory mtime_ns): adding, removing
+# or renaming a file changes the directory mtime, invalidating the entry
+_mdp_file_cache = {}
+
+def find_mdp_file(gromacs_dir, stage, present=None):
     """
     Find MDP file for the given stage
     
     Args:
         gromacs_dir: Path to GROMACS working directory
         stage: Simulation stage
+        present: Names of files in gromacs_dir, if already listed
     
     Returns:
         Path to MDP file (creates basic one if not found)
     """
+    try:
+        cache_key = (gromacs_dir, stage, os.stat(gromacs_dir).st_mtime_ns)
+    except OSError:
+        cache_key = None
+    if cache_key in _mdp_file_cache:
+        return _mdp_file_cache[cache_key]
+    
     stage_mdp_options = {
         "setup": [
             "step4_0_minimization.mdp", 
@@ -136,29 +472,24 @@ def find_mdp_file(gromacs_dir, stage):
     }
     
     possible_files = stage_mdp_options.get(stage, ["step5_production.mdp"])
+    if present is None:
+        present = _list_files(gromacs_dir)
     
     for fname in possible_files:
         fpath = os.path.join(gromacs_dir, fname)
-        if os.path.exists(fpath):
+        if fname in present:
+            if cache_key is not None:
+                _mdp_file_cache[cache_key] = fpath
             return fpath
     
     # If no MDP found, create a basic one
     print(f"Warning: No MDP file found for {stage}, creating basic template")
     return create_basic_mdp(gromacs_dir, stage)
 
-def create_basic_mdp(gromacs_dir, stage):
-    """
-    Create a basic MDP file if none exists
-    
-    Args:
-        gromacs_dir: Path to GROMACS working directory
-        stage: Simulation stage
-    
-    Returns:
-        Path to created MDP file
-    """
-    if stage == "setup":
-        content = """; Energy Minimization
+# Built-in MDP templates by stage: (file name, contents as bytes), written
+# as-is by create_basic_mdp. Unknown stages get the production template.
+_MDP_TEMPLATES = {
+    "setup": ("minim.mdp", b"""; Energy Minimization
 ; Created automatically by GROMACS MD Runner
 
 integrator               = steep
@@ -189,11 +520,8 @@ rvdw                     = 1.2
 
 ; Constraints
 constraints              = none
-"""
-        fname = "minim.mdp"
-    
-    elif stage == "equilibration":
-        content = """; NVT Equilibration
+"""),
+    "equilibration": ("equil.mdp", b"""; NVT Equilibration
 ; Created automatically by GROMACS MD Runner
 
 ; Run parameters
@@ -242,11 +570,8 @@ pcoupl                   = no
 gen_vel                  = yes
 gen_temp                 = 300
 gen_seed                 = -1
-"""
-        fname = "equil.mdp"
-    
-    else:  # production
-        content = """; Production MD
+"""),
+    "production": ("md.mdp", b"""; Production MD
 ; Created automatically by GROMACS MD Runner
 
 ; Run parameters
@@ -297,14 +622,31 @@ compressibility          = 4.5e-5
 
 ; Velocity generation
 gen_vel                  = no
-"""
-        fname = "md.mdp"
+"""),
+}
+
+def create_basic_mdp(gromacs_dir, stage):
+    """
+    Create a basic MDP file if none exists
+    
+    Args:
+        gromacs_dir: Path to GROMACS working directory
+        stage: Simulation stage
     
+    Returns:
+        Path to created MDP file
+    """
+    fname, content = _MDP_TEMPLATES.get(stage, _MDP_TEMPLATES["production"])
     output_path = os.path.join(gromacs_dir, fname)
     
     try:
-        with open(output_path, 'w') as f:
-            f.write(content)
+        fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
         return output_path
     except Exception as e:
         raise Exception(f"Failed to create MDP file {fname}: {str(e)}")
@@ -316,7 +658,10 @@ def run_md(
     use_gpu=False,
     log_callback=None, 
     progress_callback=None, 
-    pid_callback=None
+    pid_callback=None,
+    chunked=False,
+    total_steps=None,
+    resume=False
 ):
     """
     Run a GROMACS MD simulation stage
@@ -329,6 +674,12 @@ def run_md(
         log_callback: Function to receive log messages
         progress_callback: Function to receive progress updates (current_step, total_steps)
         pid_callback: Function to receive process ID
+        chunked: Pass grompp/mdrun output to log_callback one read batch
+            (several newline-terminated lines) per call instead of per line
+        total_steps: Steps to run to (default: nsteps from the MDP file)
+        resume: Continue from the stage's checkpoint ({prefix}.cpt) with the
+            existing .tpr instead of preprocessing again; falls back to a
+            fresh run when there is no checkpoint
     
     Returns:
         Exit code (0 for success)
@@ -345,8 +696,11 @@ def run_md(
         pid_callback = lambda pid: None
     
     try:
+        # One directory listing answers every file check below
+        present = _list_files(gromacs_dir)
+        
         # Validate environment
-        validate_environment(gromacs_dir, stage)
+        validate_environment(gromacs_dir, stage, present)
         
         # Check GROMACS installation
         gmx_cmd = check_gmx_command()
@@ -354,12 +708,12 @@ def run_md(
             raise Exception("GROMACS (gmx) not found in PATH. Please install GROMACS.")
         
         # Find MDP file
-        mdp_file = find_mdp_file(gromacs_dir, stage)
+        mdp_file = find_mdp_file(gromacs_dir, stage, present)
         
         # Get nsteps from MDP for progress tracking
-        from mdp_utils import read_mdp_parameter
-        nsteps_str = read_mdp_parameter(mdp_file, 'nsteps')
-        total_steps = int(nsteps_str) if nsteps_str else 50000
+        if total_steps is None:
+            nsteps_str = read_mdp_parameter(mdp_file, 'nsteps')
+            total_steps = int(nsteps_str) if nsteps_str else 50000
         
         # Determine input/output files based on stage
         if stage == "setup":
@@ -367,16 +721,16 @@ def run_md(
             output_prefix = "setup"
         elif stage == "equilibration":
             # Try to use output from previous stage
-            if os.path.exists(os.path.join(gromacs_dir, "setup.gro")):
+            if "setup.gro" in present:
                 input_structure = "setup.gro"
             else:
                 input_structure = "step3_input.gro"
             output_prefix = "equil"
         else:  # production
             # Try to use output from equilibration, then setup, then original
-            if os.path.exists(os.path.join(gromacs_dir, "equil.gro")):
+            if "equil.gro" in present:
                 input_structure = "equil.gro"
-            elif os.path.exists(os.path.join(gromacs_dir, "setup.gro")):
+            elif "setup.gro" in present:
                 input_structure = "setup.gro"
             else:
                 input_structure = "step3_input.gro"
@@ -390,180 +744,272 @@ def run_md(
         log_callback(f"📁 Working directory: {gromacs_dir}\n")
         log_callback(f"📝 MDP file: {os.path.basename(mdp_file)}\n")
         log_callback(f"🔢 Total steps: {total_steps:,}\n")
-        log_callback(f"🧵 CPU threads: {threads}\n")
+        # Log what mdrun will actually get: the request is capped to the
+        # affinity mask and may be split into one rank per NUMA node
+        thread_flags, mdrun_env = _mdrun_thread_flags(threads, use_gpu)
+        ntmpi = int(thread_flags[thread_flags.index("-ntmpi") + 1])
+        ntomp = int(thread_flags[thread_flags.index("-ntomp") + 1])
+        pin = thread_flags[thread_flags.index("-pin") + 1]
+        log_callback(
+            f"🧵 CPU threads: {ntmpi * ntomp} ({ntmpi} rank(s) × {ntomp} OpenMP, "
+            f"-pin {pin}; requested {threads})\n"
+        )
         log_callback(f"📊 Input structure: {input_structure}\n")
         log_callback(f"📁 Output prefix: {output_prefix}\n")
         log_callback(f"{'=' * 70}\n\n")
         
-        # Step 1: grompp (preprocessing)
-        log_callback(f"🔧 Running grompp (preprocessing)...\n")
+        # A paused run continues from its checkpoint; the .tpr it was
+        # started from is still in place, so grompp is skipped
+        checkpoint = f"{output_prefix}.cpt"
+        if resume and not {checkpoint, f"{output_prefix}.tpr"} <= present:
+            log_callback(f"⚠️ No checkpoint ({checkpoint}) to resume from; starting the stage afresh\n")
+            resume = False
         
-        grompp_cmd = [
-            gmx_cmd, "grompp",
-            "-f", os.path.basename(mdp_file),
-            "-c", input_structure,
-            "-p", "topol.top",
-            "-o", f"{output_prefix}.tpr",
-            "-maxwarn", "10"
-        ]
-        
-        log_callback(f"Command: {' '.join(grompp_cmd)}\n")
-        
-        with open(log_file, "w") as f:
-            f.write(f"{'=' * 70}\n")
-            f.write(f"GROMPP PREPROCESSING\n")
-            f.write(f"{'=' * 70}\n")
-            f.write(f"Started at: {datetime.now().isoformat()}\n")
-            f.write(f"Command: {' '.join(grompp_cmd)}\n")
-            f.write(f"{'=' * 70}\n\n")
-        
-        grompp_result = subprocess.run(
-            grompp_cmd,
-            cwd=gromacs_dir,
-            capture_output=True,
-            text=True,
-            timeout=300  # 5 minutes max for preprocessing
-        )
-        
-        # Log grompp output
-        with open(log_file, "a") as f:
-            f.write(grompp_result.stdout)
-            if grompp_result.stderr:
-                f.write("\n--- STDERR ---\n")
-                f.write(grompp_result.stderr)
-        
-        if grompp_result.returncode != 0:
-            error_msg = f"❌ grompp failed with exit code {grompp_result.returncode}\n"
-            error_msg += f"Check {log_file} for details\n"
-            log_callback(error_msg)
-            raise Exception(error_msg)
-        
-        log_callback(f"✅ Preprocessing completed\n\n")
-        
-        # Emit special marker after grompp completes
-        log_callback("__SETUP_COMPLETED__")
+        if resume:
+            log_callback(f"⏯ Resuming from checkpoint {checkpoint}\n")
+            with open(log_file, "a") as f:
+                f.write(f"\n{'=' * 70}\n")
+                f.write(f"RESUMED from {checkpoint} at {datetime.now().isoformat()}\n")
+                f.write(f"{'=' * 70}\n\n")
+        else:
+            # Step 1: grompp (preprocessing)
+            log_callback(f"🔧 Running grompp (preprocessing)...\n")
+            
+            grompp_cmd = [
+                gmx_cmd, "grompp",
+                "-f", os.path.basename(mdp_file),
+                "-c", input_structure,
+                "-p", "topol.top",
+                "-o", f"{output_prefix}.tpr",
+                "-maxwarn", "10"
+            ]
+            
+            log_callback(f"Command: {' '.join(grompp_cmd)}\n")
+            
+            with open(log_file, "w") as f:
+                f.write(f"{'=' * 70}\n")
+                f.write(f"GROMPP PREPROCESSING\n")
+                f.write(f"{'=' * 70}\n")
+                f.write(f"Started at: {datetime.now().isoformat()}\n")
+                f.write(f"Command: {' '.join(grompp_cmd)}\n")
+                f.write(f"{'=' * 70}\n\n")
+            
+            # Reuse the .tpr from an earlier grompp with identical inputs. The
+            # cached file is hard-linked as {output_prefix}.tpr.
+            tpr_file = os.path.join(gromacs_dir, f"{output_prefix}.tpr")
+            tpr_cache_dir = os.path.join(gromacs_dir, TPR_CACHE_DIR)
+            try:
+                digest = _grompp_digest(
+                    gromacs_dir, grompp_cmd,
+                    (os.path.basename(mdp_file), input_structure, "topol.top")
+                )
+            except OSError:
+                digest = None  # an input is missing; let grompp report it
+            cached_tpr = digest and os.path.join(tpr_cache_dir, f"{output_prefix}.{digest}.tpr")
+            
+            if cached_tpr and os.path.isfile(cached_tpr):
+                _link_replace(cached_tpr, tpr_file)
+                log_callback(f"♻️ Inputs unchanged since an earlier run; reusing {output_prefix}.tpr ({digest})\n")
+                with open(log_file, "a") as f:
+                    f.write(f"Inputs unchanged; reused {cached_tpr}\n")
+            else:
+                # A linked .tpr is a cache entry; drop the link first so grompp
+                # can't write through it (GMX_MAXBACKUP=-1 overwrites in place)
+                try:
+                    if os.stat(tpr_file).st_nlink > 1:
+                        os.unlink(tpr_file)
+                except OSError:
+                    pass
+            
+                # Stream grompp output to the log as it is printed, like mdrun's
+                with open(log_file, "a", buffering=LOG_WRITE_BUFFER) as log_fh:
+                    process = subprocess.Popen(
+                        grompp_cmd,
+                        cwd=gromacs_dir,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        bufsize=0
+                    )
+                    last_output = time.monotonic()
+                
+                    def grompp_idle():
+                        log_fh.flush()
+                        if time.monotonic() - last_output > GROMPP_IDLE_TIMEOUT:
+                            process.kill()
+                
+                    for lines in _iter_output_batches(process, on_idle=grompp_idle):
+                        last_output = time.monotonic()
+                        text = "".join(lines)
+                        if chunked:
+                            log_callback(text)
+                        else:
+                            for line in lines:
+                                log_callback(line)
+                        log_fh.write(text)
+                
+                    grompp_returncode = process.wait()
+            
+                if grompp_returncode != 0:
+                    error_msg = f"❌ grompp failed with exit code {grompp_returncode}\n"
+                    if time.monotonic() - last_output > GROMPP_IDLE_TIMEOUT:
+                        error_msg = f"❌ grompp printed nothing for {GROMPP_IDLE_TIMEOUT} s and was stopped\n"
+                    error_msg += f"Check {log_file} for details\n"
+                    log_callback(error_msg)
+                    raise Exception(error_msg)
+            
+                if cached_tpr:
+                    try:
+                        os.makedirs(tpr_cache_dir, exist_ok=True)
+                        _link_replace(tpr_file, cached_tpr)
+                        _evict_tpr_cache(tpr_cache_dir, output_prefix, cached_tpr)
+                    except OSError:
+                        pass  # caching is best effort
+            
+            log_callback(f"✅ Preprocessing completed\n\n")
         
         # Step 2: mdrun (actual simulation)
         mdrun_cmd = [
             gmx_cmd, "mdrun",
             "-deffnm", output_prefix,
-            "-nt", str(threads)
+            *thread_flags
         ]
+        if resume:
+            # -noappend: the runner's own notes share {prefix}.log, so
+            # mdrun's append-time checksum check on it would fail
+            mdrun_cmd.extend(["-cpi", checkpoint, "-noappend", "-nsteps", str(total_steps)])
         
         if use_gpu:
             mdrun_cmd.extend(["-nb", "gpu", "-pme", "gpu", "-bonded", "gpu"])
+            # Keep integration and constraints on the GPU too, avoiding a
+            # coordinate round trip every step. mdrun only supports this for
+            # the leap-frog integrator and refuses it with Nose-Hoover, so
+            # only ask for it when the MDP allows it (never for minimization).
+            integrator = (read_mdp_parameter(mdp_file, 'integrator') or "md").lower()
+            tcoupl = (read_mdp_parameter(mdp_file, 'tcoupl') or "").lower()
+            if stage != "setup" and integrator == "md" and tcoupl not in ("nose-hoover", "nose_hoover"):
+                mdrun_cmd.extend(["-update", "gpu"])
             log_callback(f"🎮 GPU acceleration enabled\n")
         
         log_callback(f"🚀 Starting {stage.capitalize()} MD simulation...\n")
         log_callback(f"Command: {' '.join(mdrun_cmd)}\n")
         log_callback(f"{'=' * 70}\n")
         
-        with open(log_file, "a") as f:
-            f.write(f"\n{'=' * 70}\n")
-            f.write(f"MDRUN COMMAND\n")
-            f.write(f"{'=' * 70}\n")
-            f.write(f"{' '.join(mdrun_cmd)}\n")
-            f.write(f"{'=' * 70}\n\n")
-        
-        # Start the process
-        process = subprocess.Popen(
-            mdrun_cmd,
-            cwd=gromacs_dir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        pid_callback(process.pid)
-        log_callback(f"📊 Process PID: {process.pid}\n\n")
-        
-        # Monitor output
-        start_time = time.time()
-        last_progress_update = 0
-        last_step = 0
-        
-        # More specific error patterns
-        error_patterns = [
-            r"Fatal error",
-            r"Segmentation fault",
-            r"ERROR:",
-            r"Error termination",
-            r"gmx.*returned non-zero"
-        ]
+        # One handle for the whole run; mdrun output is written through a
+        # 64 KiB buffer and flushed periodically rather than per line. Once
+        # mdrun starts, writes go through a single writer thread (in order),
+        # so a slow disk never holds up reading the pipe. Leaving the block
+        # waits for queued writes before the file is closed.
+        with open(log_file, "a", buffering=LOG_WRITE_BUFFER) as log_fh, \
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="md-log-writer"
+                ) as log_writer:
+            log_fh.write(f"\n{'=' * 70}\n")
+            log_fh.write(f"MDRUN COMMAND\n")
+            log_fh.write(f"{'=' * 70}\n")
+            log_fh.write(f"{' '.join(mdrun_cmd)}\n")
+            log_fh.write(f"{'=' * 70}\n\n")
+        
+            # Start the process (binary pipe; _iter_output_batches decodes)
+            process = subprocess.Popen(
+                mdrun_cmd,
+                cwd=gromacs_dir,
+                env=mdrun_env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0
+            )
         
-        for line in iter(process.stdout.readline, ''):
-            if line:
-                log_callback(line)
-                with open(log_file, "a") as f:
-                    f.write(line)
+            pid_callback(process.pid)
+            log_callback(f"📊 Process PID: {process.pid}\n\n")
+        
+            # Monitor output
+            start_time = time.monotonic()
+            last_pct = -1  # Progress is only reported when the whole percentage grows
+            seen_step = False  # Once mdrun prints step counters, percentages are ignored
+            unflushed = 0
+            last_flush = time.monotonic()
+        
+            # Quiet spells (e.g. while mdrun writes output files) flush
+            # whatever is still buffered for the log file
+            for lines in _iter_output_batches(
+                process, on_idle=lambda: log_writer.submit(log_fh.flush)
+            ):
+                text = "".join(lines)
+                if chunked:
+                    log_callback(text)
+                else:
+                    for line in lines:
+                        log_callback(line)
+                log_writer.submit(log_fh.write, text)
+                unflushed += len(lines)
+                if unflushed >= LOG_FLUSH_LINES or time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL:
+                    log_writer.submit(log_fh.flush)
+                    unflushed = 0
+                    last_flush = time.monotonic()
                 
-                # Parse progress - multiple patterns
-                step = None
-                current_time = time.time()
+                # Parse progress over the whole batch in one scan; only the
+                # latest value matters, and a step counter wins over a
+                # percentage (mdrun -v lines also carry "imb F 2%"), in
+                # this batch and every later one
+                step = pct = None
+                for match in _PROGRESS_RE.finditer(text):
+                    if match.lastgroup == "step":
+                        step = match.group("step")
+                    else:
+                        pct = match.group("pct")
                 
-                # Pattern 1: Standard "Step" output from MD runs
-                step_match = re.search(r"Step\s+(\d+)", line, re.IGNORECASE)
-                if step_match:
-                    step = int(step_match.group(1))
+                if step is not None:
+                    step = int(step)
+                    seen_step = True
+                elif pct is not None and not seen_step:
+                    # Convert percentage to step approximation
+                    step = int((float(pct) / 100.0) * total_steps)
                 
-                # Pattern 2: Energy minimization or setup stage (e.g., "Step   100 ...")
-                if step is None:
-                    em_match = re.search(r"Step\s*=\s*(\d+)", line, re.IGNORECASE)
-                    if em_match:
-                        step = int(em_match.group(1))
+                # Update progress if we extracted a step that moves the
+                # percentage forward; the bar never goes backwards
+                if step is not None:
+                    step_pct = step * 100 // total_steps if total_steps > 0 else 0
+                    if step_pct > last_pct:
+                        progress_callback(step, total_steps)
+                        last_pct = step_pct
                 
-                # Pattern 3: Progress percentage patterns (for setup/preprocessing)
-                if step is None and "%" in line:
-                    pct_match = re.search(r"(\d+(?:\.\d+)?)\s*%", line)
-                    if pct_match:
-                        pct = float(pct_match.group(1))
-                        # Convert percentage to step approximation
-                        step = int((pct / 100.0) * total_steps)
-                
-                # Update progress if we extracted a step
-                if step is not None and current_time - last_progress_update > 0.5 and step != last_step:
-                    progress_callback(step, total_steps)
-                    last_progress_update = current_time
-                    last_step = step
-                
-                # Check for errors with more specific patterns
-                for pattern in error_patterns:
-                    if re.search(pattern, line, re.IGNORECASE):
-                        log_callback(f"⚠️ Error detected: {line.strip()}\n")
-                        break
-        
-        process.wait()
-        
-        # Ensure progress reaches 100% on completion
-        if process.returncode == 0:
-            progress_callback(total_steps, total_steps)
-        
-        # Calculate runtime
-        runtime = time.time() - start_time
-        hours = int(runtime // 3600)
-        minutes = int((runtime % 3600) // 60)
-        seconds = int(runtime % 60)
-        
-        # Final status
-        success = process.returncode == 0
-        status_emoji = "✅" if success else "❌"
-        
-        final_msg = f"\n{status_emoji} Simulation {'completed successfully' if success else 'failed'}\n"
-        final_msg += f"⏱️  Runtime: {hours:02d}:{minutes:02d}:{seconds:02d}\n"
-        final_msg += f"🔢 Exit code: {process.returncode}\n"
-        
-        log_callback(final_msg)
-        
-        with open(log_file, "a") as f:
-            f.write(f"\n{'=' * 70}\n")
-            f.write(f"SIMULATION {'COMPLETED' if success else 'FAILED'}\n")
-            f.write(f"{'=' * 70}\n")
-            f.write(f"Runtime: {hours:02d}:{minutes:02d}:{seconds:02d}\n")
-            f.write(f"Exit code: {process.returncode}\n")
-            f.write(f"Completed at: {datetime.now().isoformat()}\n")
-            f.write(f"{'=' * 70}\n")
+                # Check for errors: one search per batch, lines only on a hit
+                if _ERROR_RE.search(text):
+                    for line in lines:
+                        if _ERROR_RE.search(line):
+                            log_callback(f"⚠️ Error detected: {line.strip()}\n")
+        
+            process.wait()
+        
+            # Ensure progress reaches 100% on completion
+            if process.returncode == 0:
+                progress_callback(total_steps, total_steps)
+        
+            # Calculate runtime
+            # Monotonic clock: immune to wall-clock adjustments mid-run
+            minutes, seconds = divmod(int(time.monotonic() - start_time), 60)
+            hours, minutes = divmod(minutes, 60)
+        
+            # Final status
+            success = process.returncode == 0
+            status_emoji = "✅" if success else "❌"
+        
+            final_msg = f"\n{status_emoji} Simulation {'completed successfully' if success else 'failed'}\n"
+            final_msg += f"⏱️  Runtime: {hours:02d}:{minutes:02d}:{seconds:02d}\n"
+            final_msg += f"🔢 Exit code: {process.returncode}\n"
+        
+            log_callback(final_msg)
+        
+            log_writer.submit(
+                log_fh.write,
+                f"\n{'=' * 70}\n"
+                f"SIMULATION {'COMPLETED' if success else 'FAILED'}\n"
+                f"{'=' * 70}\n"
+                f"Runtime: {hours:02d}:{minutes:02d}:{seconds:02d}\n"
+                f"Exit code: {process.returncode}\n"
+                f"Completed at: {datetime.now().isoformat()}\n"
+                f"{'=' * 70}\n"
+            )
         
         if not success:
             raise Exception(f"MD simulation failed with exit code {process.returncode}")
@@ -585,6 +1031,128 @@ def run_md(
             pass  # Ignore errors writing to log
         raise
 
+def _discard_log(msg):
+    """Batch-mode log_callback: each run's output already goes to its log file"""
+
+def _discard_progress(current, total):
+    """Batch-mode progress_callback"""
+
+def _pin_batch_worker(cpus, threads, next_slot):
+    """
+    ProcessPoolExecutor initializer for run_md_batch: confine this worker to
+    its own `threads` CPUs, so concurrent mdruns don't share cores (mdrun
+    then stays within the inherited mask; see _mdrun_thread_flags)
+    """
+    with next_slot.get_lock():
+        slot = next_slot.value
+        next_slot.value += 1
+    own_cpus = cpus[slot * threads:(slot + 1) * threads]
+    if own_cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, own_cpus)
+
+def run_md_batch(
+    gromacs_dirs,
+    stage,
+    threads=1,
+    use_gpu=False,
+    max_workers=None,
+    log_callback=None,
+    progress_callback=None
+):
+    """
+    Run the same stage in several independent GROMACS directories at once
+    (replicas, parameter scans), one worker process per run
+    
+    Args:
+        gromacs_dirs: Working directories, one independent system each
+        stage: Simulation stage ("setup", "equilibration", "production")
+        threads: CPU threads for each mdrun; workers * threads should not
+            exceed the cores available, or the runs slow each other down
+        use_gpu: Whether to use GPU acceleration
+        max_workers: Concurrent runs (default: available cores // threads)
+        log_callback: Passed to each run_md; must be a picklable module-level
+            function (default: discard, output goes to each directory's log file)
+        progress_callback: Passed to each run_md, same constraint
+            (default: discard)
+    
+    Returns:
+        Dict of directory -> exit code, or the exception that run raised.
+    """
+    threads = max(1, int(threads))
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = list(range(os.cpu_count() or 1))
+    if max_workers is None:
+        max_workers = max(1, len(cpus) // threads)
+    
+    # run_md's own defaults print every output line; with several workers
+    # sharing one stdout that is just interleaved noise
+    if log_callback is None:
+        log_callback = _discard_log
+    if progress_callback is None:
+        progress_callback = _discard_progress
+    
+    results = {}
+    # Callbacks must be picklable to reach a worker process: lambdas and
+    # Streamlit session objects are not
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_pin_batch_worker,
+        initargs=(cpus, threads, multiprocessing.Value("i", 0))
+    ) as executor:
+        futures = {
+            executor.submit(
+                run_md, gromacs_dir, stage, threads=threads, use_gpu=use_gpu,
+                log_callback=log_callback, progress_callback=progress_callback
+            ): gromacs_dir
+            for gromacs_dir in gromacs_dirs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            gromacs_dir = futures[future]
+            try:
+                results[gromacs_dir] = future.result()
+            except Exception as e:
+                results[gromacs_dir] = e
+    return results
+
+def _wait_pid_exit(pid, timeout):
+    """
+    Wait up to timeout seconds for pid to terminate. Returns True once it has.
+
+    Uses a pidfd where available (Linux 5.3+), which becomes readable the
+    moment the process exits, so there is no polling and the exit status is
+    left for run_md's Popen to collect. Elsewhere, falls back to a
+    kill(pid, 0) poll with exponential backoff.
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        pidfd = None
+
+    if pidfd is not None:
+        try:
+            with selectors.DefaultSelector() as sel:
+                sel.register(pidfd, selectors.EVENT_READ)
+                return bool(sel.select(timeout))
+        finally:
+            os.close(pidfd)
+
+    deadline = time.monotonic() + timeout
+    interval, max_interval = STOP_POLL_INTERVAL
+    while True:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
 def stop_md(pid, timeout=10):
     """
     Stop a running MD simulation gracefully, then forcefully if needed
@@ -611,26 +1179,16 @@ def stop_md(pid, timeout=10):
         os.kill(pid, signal.SIGTERM)
         
         # Wait for process to terminate
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                os.kill(pid, 0)  # Check if process still exists
-                time.sleep(0.2)
-            except ProcessLookupError:
-                # Process terminated successfully
-                return True
+        if _wait_pid_exit(pid, timeout):
+            # Process terminated successfully
+            return True
         
         # If still running after timeout, force kill (SIGKILL)
         try:
             os.kill(pid, signal.SIGKILL)
-            time.sleep(0.5)
             
             # Verify it's dead
-            try:
-                os.kill(pid, 0)
-                return False  # Still alive somehow
-            except ProcessLookupError:
-                return True  # Finally dead
+            return _wait_pid_exit(pid, STOP_KILL_TIMEOUT)
                 
         except ProcessLookupError:
             return True  # Died before we could kill it
@@ -646,6 +1204,10 @@ def stop_md(pid, timeout=10):
         return False
 
 
+# Frame counts by (path, mtime_ns, size), so an unchanged trajectory is only
+# scanned by gmx check once per process
+_trajectory_frames_cache = {}
+
 def get_trajectory_frames(trajectory_path, timeout=30):
     """
     Get number of frames in a GROMACS trajectory file
@@ -657,6 +1219,21 @@ def get_trajectory_frames(trajectory_path, timeout=30):
     Returns:
         Number of frames, or None if unable to determine
     """
+    try:
+        stat_result = os.stat(trajectory_path)
+        cache_key = (trajectory_path, stat_result.st_mtime_ns, stat_result.st_size)
+    except OSError:
+        cache_key = None
+    if cache_key in _trajectory_frames_cache:
+        return _trajectory_frames_cache[cache_key]
+    
+    frames = _count_trajectory_frames(trajectory_path, timeout)
+    if frames is not None and cache_key is not None:
+        _trajectory_frames_cache[cache_key] = frames
+    return frames
+
+def _count_trajectory_frames(trajectory_path, timeout):
+    """Run gmx check on a trajectory and parse its frame count (None on failure)"""
     try:
         result = subprocess.run(
             ["gmx", "check", "-f", trajectory_path],
@@ -709,23 +1286,17 @@ def parse_mmpbsa_input(input_file):
     }
     
     try:
-        with open(input_file, 'r') as f:
+        # Bytes in, one scan for all three settings; no decode needed
+        with open(input_file, 'rb') as f:
             content = f.read()
         
-        # Extract startframe
-        match = re.search(r'startframe\s*=\s*(\d+)', content, re.IGNORECASE)
-        if match:
-            settings['startframe'] = int(match.group(1))
-        
-        # Extract endframe
-        match = re.search(r'endframe\s*=\s*(\d+)', content, re.IGNORECASE)
-        if match:
-            settings['endframe'] = int(match.group(1))
-        
-        # Extract interval
-        match = re.search(r'interval\s*=\s*(\d+)', content, re.IGNORECASE)
-        if match:
-            settings['interval'] = int(match.group(1))
+        # First occurrence of each setting wins
+        found = set()
+        for match in _MMPBSA_SETTING_RE.finditer(content):
+            key = match.group(1).lower().decode()
+            if key not in found:
+                found.add(key)
+                settings[key] = int(match.group(2))
         
     except Exception as e:
         print(f"Warning: Could not parse mmpbsa.in: {e}")
@@ -733,6 +1304,18 @@ def parse_mmpbsa_input(input_file):
     return settings
 
 
+# Parsed index.ndx results by (path, mtime_ns, size): the MMPBSA tab asks
+# on every rerun, and the file rarely changes
+_index_groups_cache = {}
+
+# index.ndx group headers ("[ Protein ]"), found in one scan over the raw
+# file so the atom-number lines in between are never split in Python
+_NDX_GROUP_RE = re.compile(rb"^[ \t]*\[[ \t]*(.*?)[ \t]*\][ \t]*\r?$", re.MULTILINE)
+# Substrings of a lowercased group name marking a ligand, or ions/water
+# (which disqualify it); one alternation each instead of any() over lists
+_LIGAND_NAME_RE = re.compile("unk|lig|mol|het|resname|drug|comp|inh|sub")
+_ION_NAME_RE = re.compile("pot|cla|na|cl|ion|tip|wat|sol")
+
 def detect_index_groups(work_dir, tpr_file, log_callback=None):
     """
     Auto-detect receptor and ligand groups from index.ndx (CHARMM-GUI style)
@@ -745,64 +1328,95 @@ def detect_index_groups(work_dir, tpr_file, log_callback=None):
     index_path = os.path.join(work_dir, "index.ndx")
 
     # Case 1: index.ndx doesn't exist
-    if not os.path.exists(index_path):
+    try:
+        st = os.stat(index_path)
+    except OSError:
         log("⚠️  index.ndx file not found in working directory.")
         log("→ Using **default fallback values**: Receptor = 1, Ligand = 13")
         return 1, 13
 
+    # An unchanged file gives the same groups and messages; replay them
+    cache_key = (index_path, st.st_mtime_ns, st.st_size)
+    cached = _index_groups_cache.get(cache_key)
+    if cached is None:
+        try:
+            cached = _scan_index_groups(index_path)
+        except Exception as e:
+            log(f"❌ Error during group auto-detection: {str(e)}")
+            log("→ Falling back to safe defaults: Receptor = 1, Ligand = 13")
+            return 1, 13
+        _index_groups_cache[cache_key] = cached
+
+    receptor_group, ligand_group, messages = cached
+    for msg in messages:
+        log(msg)
+    return receptor_group, ligand_group
+
+def _scan_index_groups(index_path):
+    """
+    Parse index.ndx for detect_index_groups.
+    Returns (receptor_group, ligand_group, log messages); raises on read errors
+    """
+    log_lines = []
+    log = log_lines.append
+
     receptor_group = None
     ligand_group   = None
 
-    try:
-        current_group_num = 0
-        with open(index_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('[') and line.endswith(']'):
-                    current_group_num += 1
-                    name_raw = line[1:-1].strip()
-                    name = name_raw.lower()
-
-                    # Receptor: prefer full protein, avoid partial like -H
-                    if 'protein' in name and '-h' not in name and receptor_group is None:
-                        receptor_group = current_group_num
-                        log(f"✓ Auto-detected **receptor** group: {current_group_num} → '{name_raw}'")
-
-                    # Ligand: match common names, exclude ions/water
-                    ligand_keywords = ['unk', 'lig', 'mol', 'ligand', 'het', 'resname', 'drug', 'comp', 'inh', 'sub']
-                    ion_keywords = ['pot', 'cla', 'na', 'cl', 'ion', 'tip', 'wat', 'sol']
-                    if any(kw in name for kw in ligand_keywords) and not any(ik in name for ik in ion_keywords):
-                        if ligand_group is None:
-                            ligand_group = current_group_num
-                            log(f"✓ Auto-detected **ligand** group: {current_group_num} → '{name_raw}'")
-
-        # Fallbacks if nothing found
-        messages = []
-        if receptor_group is None:
-            receptor_group = 1
-            messages.append("   → Receptor set to default: 1 (Protein)")
-        if ligand_group is None:
-            ligand_group = 13
-            messages.append("   → Ligand set to default: 13 (common for UNK in CHARMM-GUI)")
-
-        if messages:
-            log("⚠️  Partial or no auto-detection — using fallback values")
-            for msg in messages:
-                log(msg)
-        else:
-            log("✅ Successfully auto-detected both groups from index.ndx")
+    with open(index_path, 'rb') as f:
+        content = f.read()
 
-        log(f"→ Using groups → Receptor: {receptor_group} | Ligand: {ligand_group}")
+    for current_group_num, match in enumerate(_NDX_GROUP_RE.finditer(content), start=1):
+        name_raw = match.group(1).decode(errors="replace")
+        name = name_raw.lower()
 
-        return receptor_group, ligand_group
+        # Receptor: prefer full protein, avoid partial like -H
+        if 'protein' in name and '-h' not in name and receptor_group is None:
+            receptor_group = current_group_num
+            log(f"✓ Auto-detected **receptor** group: {current_group_num} → '{name_raw}'")
 
-    except Exception as e:
-        log(f"❌ Error during group auto-detection: {str(e)}")
-        log("→ Falling back to safe defaults: Receptor = 1, Ligand = 13")
-        return 1, 13
+        # Ligand: match common names, exclude ions/water
+        if ligand_group is None and _LIGAND_NAME_RE.search(name) and not _ION_NAME_RE.search(name):
+            ligand_group = current_group_num
+            log(f"✓ Auto-detected **ligand** group: {current_group_num} → '{name_raw}'")
+
+        # Later groups can't change either answer
+        if receptor_group is not None and ligand_group is not None:
+            break
+
+    # Fallbacks if nothing found
+    messages = []
+    if receptor_group is None:
+        receptor_group = 1
+        messages.append("   → Receptor set to default: 1 (Protein)")
+    if ligand_group is None:
+        ligand_group = 13
+        messages.append("   → Ligand set to default: 13 (common for UNK in CHARMM-GUI)")
 
+    if messages:
+        log("⚠️  Partial or no auto-detection — using fallback values")
+        for msg in messages:
+            log(msg)
+    else:
+        log("✅ Successfully auto-detected both groups from index.ndx")
 
+    log(f"→ Using groups → Receptor: {receptor_group} | Ligand: {ligand_group}")
 
+    return receptor_group, ligand_group, log_lines
+
+
+
+
+# Absolute path of gmx_MMPBSA once found. Only a hit is remembered, so
+# installing or activating it while the app runs is still picked up.
+_mmpbsa_path = None
+
+def _resolve_mmpbsa():
+    """Path to the gmx_MMPBSA executable (None if not on PATH)"""
+    global _mmpbsa_path
+    if _mmpbsa_path is None:
+        _mmpbsa_path = shutil.which("gmx_MMPBSA")
+    return _mmpbsa_path
 
 def run_mmpbsa(
     work_dir, 
@@ -815,7 +1429,9 @@ def run_mmpbsa(
     ligand_group=None,
     n_cores=None,
     log_callback=None, 
-    progress_callback=None
+    progress_callback=None,
+    core_to_mpi_ratio=1,
+    cpu_set=None
 ):
     """
     Run gmx_MMPBSA calculation with proper error handling and progress tracking
@@ -832,6 +1448,11 @@ def run_mmpbsa(
         n_cores: Number of CPU cores to use (auto-detect if None)
         log_callback: Function to receive log messages
         progress_callback: Function to receive progress updates (percentage)
+        core_to_mpi_ratio: Cores (OpenMP threads) per MPI rank (default: 1)
+        cpu_set: Logical CPU ids the run is confined to (run_mmpbsa_batch);
+            ranks are bound within them instead of from core 0. The caller's
+            thread should already have this affinity, so the processes it
+            starts inherit it.
     
     Returns:
         Exit code (0 for success)
@@ -854,6 +1475,12 @@ def run_mmpbsa(
         log(f"GMXMMPBSA BINDING FREE ENERGY CALCULATION\n")
         log(f"{'=' * 70}\n")
         
+        # Check if gmx_MMPBSA is available (resolved once per process), before
+        # any of the file checks or frame counting
+        mmpbsa_path = _resolve_mmpbsa()
+        if mmpbsa_path is None:
+            raise Exception("gmx_MMPBSA not found in PATH. Please ensure it's installed and activated.")
+        
         # Validate required files
         required_files = {
             'TPR': tpr_file,
@@ -862,10 +1489,12 @@ def run_mmpbsa(
             'Input': input_file
         }
         
+        # One listing for the plain names; exists() only for anything else
+        present = _list_files(work_dir)
         missing = []
         for name, fname in required_files.items():
             fpath = os.path.join(work_dir, fname)
-            if not os.path.exists(fpath):
+            if fname not in present and not os.path.exists(fpath):
                 missing.append(f"{name} ({fname})")
         
         if missing:
@@ -873,41 +1502,51 @@ def run_mmpbsa(
         
         log(f"✅ All required files found\n")
         
-        # Get trajectory frame count
-        traj_path = os.path.join(work_dir, trajectory)
-        n_frames = get_trajectory_frames(traj_path)
-        
-        if n_frames is not None:
-            log(f"📊 Trajectory has {n_frames} frames\n")
-        else:
-            log(f"⚠️ Could not determine frame count from trajectory\n")
-            n_frames = 1000  # Fallback estimate
-        
         # Parse MMPBSA input settings
         input_path = os.path.join(work_dir, input_file)
         settings = parse_mmpbsa_input(input_path)
         
+        # The trajectory length is only needed when the input leaves
+        # endframe open; skip gmx check otherwise
+        if settings['endframe']:
+            end = settings['endframe']
+        else:
+            traj_path = os.path.join(work_dir, trajectory)
+            n_frames = get_trajectory_frames(traj_path)
+            
+            if n_frames is not None:
+                log(f"📊 Trajectory has {n_frames} frames\n")
+            else:
+                log(f"⚠️ Could not determine frame count from trajectory\n")
+                n_frames = 1000  # Fallback estimate
+            end = n_frames
+        
         # Calculate effective frames for analysis
         start = settings['startframe']
-        end = settings['endframe'] if settings['endframe'] else n_frames
         interval = settings['interval']
         
         effective_frames = max(1, (end - start + 1) // interval)
         log(f"📊 Will analyze ~{effective_frames} frames (start={start}, end={end}, interval={interval})\n")
         
-        # Auto-detect optimal core count
+        # Auto-detect optimal core count. Ranks go one per physical core:
+        # SMT siblings share L1/L2 and the per-frame solvers are memory-bound
+        if cpu_set:
+            physical_cores = len(_core_groups(cpu_set))
+        else:
+            physical_cores = psutil.cpu_count(logical=False) or multiprocessing.cpu_count()
         if n_cores is None:
-            max_cores = multiprocessing.cpu_count()
-            # Use at most: (1) all but 1 core, (2) number of frames
-            n_cores = min(max_cores - 1, effective_frames)
-            n_cores = max(1, n_cores)  # At least 1
+            # Leave one core free for the UI and I/O
+            n_cores = max(1, physical_cores - 1)
+        
+        ratio = max(1, int(core_to_mpi_ratio))
+        n_mpi = max(1, n_cores // ratio)
         
-        # Ensure cores <= frames (gmx_MMPBSA requirement)
-        if n_cores > effective_frames:
-            log(f"⚠️ Reducing cores from {n_cores} to {effective_frames} (must have ≤ frames)\n")
-            n_cores = effective_frames
+        # Ensure ranks <= frames (gmx_MMPBSA requirement)
+        if n_mpi > effective_frames:
+            log(f"⚠️ Reducing MPI ranks from {n_mpi} to {effective_frames} (must have ≤ frames)\n")
+            n_mpi = effective_frames
         
-        log(f"🧵 Using {n_cores} CPU core(s) for parallel calculation\n")
+        log(f"🧵 Using {n_mpi} MPI rank(s) × {ratio} thread(s) for parallel calculation\n")
         
         # Auto-detect receptor and ligand groups if not provided
         if receptor_group is None or ligand_group is None:
@@ -919,28 +1558,27 @@ def run_mmpbsa(
         
         log(f"🎯 Receptor group: {receptor_group}, Ligand group: {ligand_group}\n")
         
-        # Check if gmx_MMPBSA is available
-        try:
-            result = subprocess.run(
-                ["which", "gmx_MMPBSA"],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode != 0:
-                raise Exception("gmx_MMPBSA not found in PATH. Please ensure it's installed and activated.")
-        except subprocess.TimeoutExpired:
-            raise Exception("Timeout checking for gmx_MMPBSA")
-        
         log(f"{'=' * 70}\n\n")
         
-        # Build command
-        # Note: Use --use-hwthread-cpus if MPI slots are limited
-        cmd = [
-            "mpirun",
-            "--use-hwthread-cpus",  # Allow oversubscription if needed
-            "-np", str(n_cores),
-            "gmx_MMPBSA",
+        # Build command. A single rank runs gmx_MMPBSA directly: going
+        # through mpirun would only add MPI startup for one rank.
+        if n_mpi > 1:
+            launcher = ["mpirun", "-np", str(n_mpi)]
+            if n_mpi * ratio > physical_cores:
+                # More slots than cores: binding would fail, let ranks float
+                launcher += ["--oversubscribe", "--bind-to", "none"]
+            else:
+                launcher += [
+                    "--bind-to", "core",
+                    "--map-by", f"slot:PE={ratio}" if ratio > 1 else "core"
+                ]
+                if cpu_set:
+                    # Map within this run's CPUs, not from core 0
+                    launcher += ["--cpu-set", ",".join(map(str, sorted(cpu_set)))]
+        else:
+            launcher = []
+        cmd = launcher + [
+            mmpbsa_path,  # Full path: no PATH search by mpirun per rank
             "-O",  # Overwrite existing files
             "-i", input_file,
             "-cs", tpr_file,
@@ -957,104 +1595,100 @@ def run_mmpbsa(
         # Create log file
         mmpbsa_log = os.path.join(work_dir, "gmx_MMPBSA.log")
         
-        # Start process
+        # Each rank's threads stay on the cores mpirun bound it to
+        env = dict(
+            os.environ,
+            OMP_NUM_THREADS=str(ratio),
+            OMP_PLACES="cores",
+            OMP_PROC_BIND="close"
+        )
+        
+        # Start process (binary pipe; _iter_output_batches decodes)
         process = subprocess.Popen(
             cmd,
             cwd=work_dir,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
+            bufsize=0,
+            env=env
         )
         
         log(f"📊 Process PID: {process.pid}\n\n")
         
         # Monitor output with timeout handling
-        start_time = time.time()
+        start_time = time.monotonic()
         timeout_seconds = 3600 * 24  # 24 hours max
         
         frame_count = 0
         last_progress = 0
         
-        # Error patterns to detect
-        error_patterns = [
-            r"Fatal error",
-            r"Error:",
-            r"MMPBSA_Error",
-            r"Traceback",
-            r"failed",
-            r"Cannot find",
-            r"No such file"
-        ]
-        
-        while True:
-            # Check timeout
-            if time.time() - start_time > timeout_seconds:
+        def check_timeout():
+            if time.monotonic() - start_time > timeout_seconds:
                 process.kill()
                 raise Exception(f"MMPBSA calculation timed out after {timeout_seconds}s")
+        
+        # Output is read in blocks and split here; the timeout is also
+        # checked while gmx_MMPBSA is quiet (it can be for a long time)
+        for lines in _iter_output_batches(process, on_idle=check_timeout):
+            check_timeout()
             
-            line = process.stdout.readline()
-            
-            # Check if process finished
-            if not line and process.poll() is not None:
-                break
-            
-            if line:
+            for line in lines:
                 line_stripped = line.strip()
                 log(line)
                 
-                # Track progress based on various output patterns
-                
-                # Pattern 1: Frame processing (e.g., "Processing frame 10/100")
-                if "frame" in line_stripped.lower():
-                    match = re.search(r'(\d+)\s*/\s*(\d+)', line_stripped)
-                    if match:
-                        current = int(match.group(1))
-                        total = int(match.group(2))
-                        pct = (current / total) * 100
-                        if pct > last_progress:
-                            update_progress(pct)
-                            last_progress = pct
+                # Classify the line in one scan: the first frame counter
+                # and progress bar count, and the furthest stage named
+                frac = bar = None
+                stage_index = 0
+                is_error = False
+                for match in _MMPBSA_LINE_RE.finditer(line_stripped):
+                    kind = match.lastgroup
+                    if kind == "err":
+                        is_error = True
+                    elif kind == "stage":
+                        stage_index = max(stage_index, _MMPBSA_STAGE_INDEX[match.group("stage").lower()])
+                    elif kind == "pct":
+                        if bar is None:
+                            bar = int(match.group("pct"))
+                    elif frac is None:
+                        frac = match.group("frac")
                 
-                # Pattern 2: Progress bars (e.g., "50%|##########|")
-                if "%" in line_stripped and "|" in line_stripped:
-                    match = re.search(r'(\d+)%', line_stripped)
-                    if match:
-                        pct = int(match.group(1))
-                        if pct > last_progress:
-                            update_progress(pct)
-                            last_progress = pct
-                
-                # Pattern 3: Stage completions
-                stage_markers = [
-                    "Building AMBER topologies",
-                    "Preparing trajectories",
-                    "Running calculations",
-                    "Parsing results",
-                    "completed successfully"
-                ]
-                
-                for i, marker in enumerate(stage_markers):
-                    if marker.lower() in line_stripped.lower():
+                # Track progress; once at 100% the trailing summary lines
+                # only need the error check
+                if last_progress < 100:
+                    # Pattern 1: Frame processing ("Processing frame 10/100")
+                    if frac and "frame" in line_stripped.lower():
+                        current, _, total = frac.partition("/")
+                        current, total = int(current), int(total)
+                        if total:
+                            pct = (current / total) * 100
+                            if pct > last_progress:
+                                update_progress(pct)
+                                last_progress = pct
+                    
+                    # Pattern 2: Progress bars ("50%|##########|")
+                    if bar is not None and "|" in line_stripped:
+                        if bar > last_progress:
+                            update_progress(bar)
+                            last_progress = bar
+                    
+                    # Pattern 3: Stage completions
+                    if stage_index:
                         # Each stage represents 20% progress
-                        pct = ((i + 1) / len(stage_markers)) * 100
+                        pct = (stage_index / len(MMPBSA_STAGE_MARKERS)) * 100
                         if pct > last_progress:
                             update_progress(pct)
                             last_progress = pct
                 
-                # Check for errors
-                for pattern in error_patterns:
-                    if re.search(pattern, line_stripped, re.IGNORECASE):
-                        log(f"\n⚠️ Potential error detected: {line_stripped}\n")
+                if is_error:
+                    log(f"\n⚠️ Potential error detected: {line_stripped}\n")
         
         # Wait for process to finish
         returncode = process.wait()
         
         # Calculate runtime
-        runtime = time.time() - start_time
-        hours = int(runtime // 3600)
-        minutes = int((runtime % 3600) // 60)
-        seconds = int(runtime % 60)
+        minutes, seconds = divmod(int(time.monotonic() - start_time), 60)
+        hours, minutes = divmod(minutes, 60)
         
         log(f"\n{'=' * 70}\n")
         
@@ -1094,4 +1728,88 @@ def run_mmpbsa(
         raise Exception("MMPBSA calculation interrupted by user")
     except Exception as e:
         log(f"\n❌ Error: {str(e)}\n")
-        raise
\ No newline at end of file
+        raise
+
+def run_mmpbsa_batch(
+    work_dirs,
+    tpr_file,
+    trajectory,
+    index_file,
+    n_cores=None,
+    max_workers=None,
+    log_callback=None,
+    **kwargs
+):
+    """
+    Run gmx_MMPBSA for several independent systems at once, one per working
+    directory, each on its own disjoint set of physical cores
+    
+    The runs are monitored from threads of one pool: each monitor sleeps in
+    select() on its pipe between output chunks, and the calculations
+    themselves run in the gmx_MMPBSA/MPI child processes. A monitor thread
+    takes its run's CPU affinity before starting it, so the processes it
+    starts inherit that affinity, and mpirun binds ranks within those CPUs.
+    
+    Args:
+        work_dirs: Working directories, one system each (same file names)
+        tpr_file, trajectory, index_file: As for run_mmpbsa
+        n_cores: CPU cores for each run (default: all of the run's cores)
+        max_workers: Concurrent runs (default: all of them, up to one per
+            physical core)
+        log_callback: Function receiving (work_dir, message) for each run
+        **kwargs: Passed through to run_mmpbsa (input_file, core_to_mpi_ratio...)
+    
+    Returns:
+        Dict of directory -> exit code, or the exception that run raised
+    """
+    work_dirs = list(work_dirs)
+    if not work_dirs:
+        return {}
+    try:
+        cpus = os.sched_getaffinity(0)
+    except AttributeError:  # not on Linux
+        cpus = set(range(os.cpu_count() or 1))
+    cores = _core_groups(cpus)
+    if max_workers is None:
+        max_workers = max(1, min(len(work_dirs), len(cores)))
+    
+    # One disjoint slice of whole cores per concurrent run; a finished run
+    # hands its slice to the next one
+    per_run = max(1, len(cores) // max_workers)
+    free_slices = queue.SimpleQueue()
+    for i in range(max_workers):
+        own = cores[i * per_run:(i + 1) * per_run] or cores[-per_run:]
+        free_slices.put([cpu for core in own for cpu in core])
+    if n_cores is None:
+        n_cores = per_run
+    pin = hasattr(os, "sched_setaffinity")
+    
+    def run_one(work_dir):
+        log = None
+        if log_callback:
+            log = lambda msg: log_callback(work_dir, msg)
+        cpu_set = free_slices.get()
+        previous = os.sched_getaffinity(0) if pin else None
+        try:
+            if pin:
+                os.sched_setaffinity(0, cpu_set)  # this thread only
+            return run_mmpbsa(
+                work_dir, tpr_file, trajectory, index_file,
+                n_cores=n_cores, log_callback=log,
+                cpu_set=cpu_set if pin else None, **kwargs
+            )
+        finally:
+            if pin:
+                os.sched_setaffinity(0, previous)
+            free_slices.put(cpu_set)
+    
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_one, work_dir): work_dir for work_dir in work_dirs}
+        for future in concurrent.futures.as_completed(futures):
+            work_dir = futures[future]
+            try:
+                results[work_dir] = future.result()
+            except Exception as e:
+                results[work_dir] = e
+    return results
@@ -5,7 +5,33 @@ MDP Utilities - Helper functions for manipulating GROMACS MDP files
 import os
 import re
 import shutil
+import uuid
 from datetime import datetime
+from functools import lru_cache
+
+@lru_cache(maxsize=64)
+def _param_line_re(parameter_name):
+    """
+    Compiled pattern matching every "parameter = value" assignment line
+    (case-insensitive), capturing its indentation and any trailing comment
+    """
+    return re.compile(
+        rf'^(?P<indent>[ \t]*){re.escape(parameter_name)}[ \t]*=[^\n;]*(?P<comment>;[^\n]*)?$',
+        re.IGNORECASE | re.MULTILINE
+    )
+
+_NSTEPS_RE = _param_line_re('nsteps')
+
+@lru_cache(maxsize=64)
+def _param_value_re(parameter_name):
+    """
+    Compiled bytes pattern capturing the value of a "parameter = value" line
+    anywhere in an MDP file (case-insensitive, trailing comment excluded)
+    """
+    return re.compile(
+        rb'^[ \t]*' + re.escape(parameter_name.encode()) + rb'[ \t]*=[ \t]*(.+?)(?:[ \t]*;.*)?$',
+        re.IGNORECASE | re.MULTILINE
+    )
 
 def ns_to_nsteps(ns, timestep_fs=2):
     """
@@ -65,11 +91,17 @@ def get_mdp_file(gromacs_dir, stage):
     # Get possible filenames for this stage
     possible_files = stage_options.get(stage.lower(), ["step5_production.mdp"])
     
+    # One directory listing answers every candidate, instead of a stat each
+    try:
+        with os.scandir(gromacs_dir) as it:
+            names = {entry.name for entry in it}
+    except OSError:
+        names = set()
+    
     # Find which one exists
     for fname in possible_files:
-        fpath = os.path.join(gromacs_dir, fname)
-        if os.path.exists(fpath):
-            return fpath
+        if fname in names:
+            return os.path.join(gromacs_dir, fname)
     
     # If none found, create a basic one using gromacs_runner
     # Import here to avoid circular dependency
@@ -91,23 +123,14 @@ def read_mdp_parameter(mdp_path, parameter_name):
         return None
     
     try:
-        with open(mdp_path, 'r') as f:
-            for line in f:
-                stripped = line.strip()
-                
-                # Skip empty lines and comments
-                if not stripped or stripped.startswith(';') or stripped.startswith('#'):
-                    continue
-                
-                # Check if this line contains the parameter
-                # Match: "parameter = value" or "parameter=value"
-                match = re.match(
-                    rf'^\s*{re.escape(parameter_name)}\s*=\s*(.+?)(?:\s*;.*)?$',
-                    line,
-                    re.IGNORECASE
-                )
-                if match:
-                    return match.group(1).strip()
+        with open(mdp_path, 'rb') as f:
+            content = f.read()
+        
+        # One scan over the raw bytes for the first "parameter = value" line
+        # (comment and blank lines can't match: the name must start the line)
+        match = _param_value_re(parameter_name).search(content)
+        if match:
+            return match.group(1).strip().decode(errors="replace")
         
         return None
         
@@ -115,6 +138,120 @@ def read_mdp_parameter(mdp_path, parameter_name):
         print(f"Error reading MDP parameter '{parameter_name}': {e}")
         return None
 
+@lru_cache(maxsize=16)
+def _params_value_re(parameter_names):
+    """Like _param_value_re, for any of several names; group 1 is the name"""
+    names = b'|'.join(re.escape(name.encode()) for name in parameter_names)
+    return re.compile(
+        rb'^[ \t]*(' + names + rb')[ \t]*=[ \t]*(.+?)(?:[ \t]*;.*)?$',
+        re.IGNORECASE | re.MULTILINE
+    )
+
+def read_mdp_parameters(mdp_path, parameter_names):
+    """
+    Read several parameters from an MDP file in one pass
+    
+    Args:
+        mdp_path: Path to MDP file
+        parameter_names: Names of parameters to read (case-insensitive)
+    
+    Returns:
+        Dictionary of lowercase name -> value string, or None if not found
+        (the first assignment wins, as with read_mdp_parameter)
+    """
+    try:
+        with open(mdp_path, 'rb') as f:
+            content = f.read()
+    except OSError:
+        content = b""
+    
+    return _parse_mdp_parameters(content, parameter_names)
+
+def _parse_mdp_parameters(content, parameter_names):
+    """read_mdp_parameters over MDP contents already read (bytes)"""
+    wanted = tuple(name.lower() for name in parameter_names)
+    values = dict.fromkeys(wanted)
+    
+    remaining = set(wanted)
+    for match in _params_value_re(wanted).finditer(content):
+        name = match.group(1).decode().lower()
+        if name in remaining:
+            values[name] = match.group(2).strip().decode(errors="replace")
+            remaining.discard(name)
+            if not remaining:
+                break
+    
+    return values
+
+def _backup_mdp(mdp_path):
+    """
+    Keep the current MDP contents under a timestamped backup name. A hard
+    link costs no copy: _rewrite_mdp_parameter replaces the original path
+    with a new inode, so the link keeps the old contents.
+    """
+    backup_path = f"{mdp_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    try:
+        try:
+            os.link(mdp_path, backup_path)
+        except OSError:
+            # Link unsupported (some filesystems) or backup name taken
+            shutil.copy2(mdp_path, backup_path)
+    except Exception as e:
+        print(f"Warning: Could not create backup: {e}")
+
+def _rewrite_mdp_parameter(mdp_path, line_re, parameter_name, parameter_value):
+    """
+    Set every assignment of a parameter in one substitution, appending it if
+    absent, and swap the result into place atomically via a temp file
+    """
+    with open(mdp_path, 'r') as f:
+        data = f.read()
+    
+    def replace(match):
+        comment = match.group('comment')
+        return f"{match.group('indent')}{parameter_name} = {parameter_value}{' ' + comment if comment else ''}"
+    
+    data, count = line_re.subn(replace, data)
+    
+    # If the parameter wasn't found, add it at the end with a comment
+    if count == 0:
+        data += f"\n; Added by GROMACS MD Runner\n{parameter_name} = {parameter_value}\n"
+    
+    atomic_write_text(mdp_path, data)
+
+def atomic_write_text(path, content):
+    """
+    Replace a text file atomically: write a uniquely named temp file in the
+    same directory (so concurrent writers never share it), give it the
+    original's mode and, where permitted, owner, then os.replace it in
+    """
+    tmp_path = os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp"
+    )
+    # O_EXCL: never write through someone else's file; 0o666 & ~umask is
+    # the mode a plain open() gives a new file
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            pass  # new file: keep the umask default
+        else:
+            shutil.copymode(path, tmp_path)
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except (AttributeError, PermissionError):
+                pass  # not on POSIX, or not ours to give away
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def update_mdp_nsteps(mdp_path, ns, backup=True):
     """
     Update nsteps parameter in MDP file based on simulation time in nanoseconds
@@ -150,56 +287,11 @@ def update_mdp_nsteps(mdp_path, ns, backup=True):
     
     # Create backup if requested
     if backup:
-        backup_path = f"{mdp_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        try:
-            shutil.copy2(mdp_path, backup_path)
-        except Exception as e:
-            print(f"Warning: Could not create backup: {e}")
-    
-    # Read and update the file
-    updated = False
-    new_lines = []
+        _backup_mdp(mdp_path)
     
+    # Rewrite the file
     try:
-        with open(mdp_path, 'r') as f:
-            for line in f:
-                stripped = line.strip()
-                
-                # Keep empty lines as-is
-                if not stripped:
-                    new_lines.append(line)
-                    continue
-                
-                # Keep comment lines as-is
-                if stripped.startswith(';') or stripped.startswith('#'):
-                    new_lines.append(line)
-                    continue
-                
-                # Check if this is an nsteps line (case-insensitive)
-                # Match: "nsteps = 123" or "nsteps=123"
-                if re.match(r'^\s*nsteps\s*=', line, re.IGNORECASE):
-                    # Preserve indentation
-                    indent = line[:len(line) - len(line.lstrip())]
-                    
-                    # Check for inline comment
-                    comment_match = re.search(r';.*$', line)
-                    comment = comment_match.group(0) if comment_match else ""
-                    
-                    # Write updated line with preserved formatting
-                    new_lines.append(f"{indent}nsteps = {nsteps}{' ' + comment if comment else ''}\n")
-                    updated = True
-                else:
-                    new_lines.append(line)
-        
-        # If nsteps wasn't found, add it at the end with a comment
-        if not updated:
-            new_lines.append(f"\n; Added by GROMACS MD Runner\n")
-            new_lines.append(f"nsteps = {nsteps}\n")
-        
-        # Write updated file
-        with open(mdp_path, "w") as f:
-            f.writelines(new_lines)
-        
+        _rewrite_mdp_parameter(mdp_path, _NSTEPS_RE, 'nsteps', nsteps)
         return nsteps
         
     except Exception as e:
@@ -227,52 +319,12 @@ def update_mdp_parameter(mdp_path, parameter_name, parameter_value, backup=True)
     
     # Create backup if requested
     if backup:
-        backup_path = f"{mdp_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        try:
-            shutil.copy2(mdp_path, backup_path)
-        except Exception as e:
-            print(f"Warning: Could not create backup: {e}")
-    
-    updated = False
-    new_lines = []
+        _backup_mdp(mdp_path)
     
     try:
-        with open(mdp_path, 'r') as f:
-            for line in f:
-                stripped = line.strip()
-                
-                # Keep empty lines and comments as-is
-                if not stripped or stripped.startswith(';') or stripped.startswith('#'):
-                    new_lines.append(line)
-                    continue
-                
-                # Check if this line contains the parameter (case-insensitive)
-                if re.match(rf'^\s*{re.escape(parameter_name)}\s*=', line, re.IGNORECASE):
-                    # Preserve indentation
-                    indent = line[:len(line) - len(line.lstrip())]
-                    
-                    # Check for inline comment
-                    comment_match = re.search(r';.*$', line)
-                    comment = comment_match.group(0) if comment_match else ""
-                    
-                    # Write updated line
-                    new_lines.append(
-                        f"{indent}{parameter_name} = {parameter_value}"
-                        f"{' ' + comment if comment else ''}\n"
-                    )
-                    updated = True
-                else:
-                    new_lines.append(line)
-        
-        # If parameter wasn't found, add it at the end
-        if not updated:
-            new_lines.append(f"\n; Added by GROMACS MD Runner\n")
-            new_lines.append(f"{parameter_name} = {parameter_value}\n")
-        
-        # Write updated file
-        with open(mdp_path, "w") as f:
-            f.writelines(new_lines)
-        
+        _rewrite_mdp_parameter(
+            mdp_path, _param_line_re(parameter_name), parameter_name, parameter_value
+        )
         return True
         
     except Exception as e:
@@ -294,20 +346,23 @@ def validate_mdp_file(mdp_path):
     errors = []
     
     try:
-        with open(mdp_path, 'r') as f:
+        # One read serves both the parameter scan and the emptiness check
+        with open(mdp_path, 'rb') as f:
             content = f.read()
         
+        params = _parse_mdp_parameters(content, ('integrator', 'dt', 'nsteps'))
+        
         # Check for required parameters based on integrator
-        integrator = read_mdp_parameter(mdp_path, 'integrator')
+        integrator = params['integrator']
         
         if integrator and integrator.lower() != 'steep':
             # MD run - check for dt
-            dt = read_mdp_parameter(mdp_path, 'dt')
+            dt = params['dt']
             if not dt:
                 errors.append("Missing required parameter: dt (timestep)")
         
         # Check for nsteps
-        nsteps = read_mdp_parameter(mdp_path, 'nsteps')
+        nsteps = params['nsteps']
         if not nsteps:
             errors.append("Missing required parameter: nsteps")
         
@@ -341,11 +396,13 @@ def get_mdp_info(mdp_path):
     if not os.path.exists(mdp_path):
         return info
     
-    info['integrator'] = read_mdp_parameter(mdp_path, 'integrator')
-    info['dt'] = read_mdp_parameter(mdp_path, 'dt')
-    info['nsteps'] = read_mdp_parameter(mdp_path, 'nsteps')
-    info['temperature'] = read_mdp_parameter(mdp_path, 'ref_t')
-    info['pressure_coupling'] = read_mdp_parameter(mdp_path, 'pcoupl')
+    # One pass over the file for all five
+    params = read_mdp_parameters(mdp_path, ('integrator', 'dt', 'nsteps', 'ref_t', 'pcoupl'))
+    info['integrator'] = params['integrator']
+    info['dt'] = params['dt']
+    info['nsteps'] = params['nsteps']
+    info['temperature'] = params['ref_t']
+    info['pressure_coupling'] = params['pcoupl']
     
     return info
 
@@ -2,18 +2,70 @@
 System Information - Utilities for detecting CPU and GPU resources
 """
 
+import os
 import psutil
+import shutil
 import subprocess
 import platform
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from functools import lru_cache, wraps
+
+GPU_PROBE_TIMEOUT = 5  # Seconds allowed per vendor tool
+
+# Linux DRM devices, and the PCI ids that mark an Intel VGA controller
+DRM_CLASS_DIR = "/sys/class/drm"
+INTEL_PCI_VENDOR_ID = "0x8086"
+PCI_VGA_CLASS = "0x0300"
+
+# NVML bindings (optional): query the driver in-process instead of starting
+# nvidia-smi, which reloads the driver on every call
+try:
+    import pynvml
+    pynvml.nvmlInit()
+    _NVML_AVAILABLE = True
+except Exception:  # Not installed, or no NVIDIA driver
+    _NVML_AVAILABLE = False
+
+def _nvml_str(value):
+    """NVML names are bytes in older pynvml releases"""
+    return value.decode() if isinstance(value, bytes) else value
+
+def _ttl_cache(seconds):
+    """
+    Memoize a probe for `seconds` so repeated calls don't re-fork or re-sample
+    
+    Results are keyed on the call arguments and expire on the monotonic clock.
+    """
+    def decorator(func):
+        entries = {}
+        
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            entry = entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            value = func(*args, **kwargs)
+            entries[key] = (now + seconds, value)
+            return value
+        
+        wrapper.cache_clear = entries.clear
+        return wrapper
+    return decorator
+
+@lru_cache(maxsize=None)
+def _processor_name():
+    """platform.processor() never changes but may fork uname to find out"""
+    return platform.processor()
 
 def check_mmpbsa_installed():
     """Check if gmx_MMPBSA is available in the current environment"""
-    try:
-        result = subprocess.run(["which", "gmx_MMPBSA"], capture_output=True, text=True)
-        return result.returncode == 0
-    except:
-        return False
+    return shutil.which("gmx_MMPBSA") is not None
 
+@_ttl_cache(60)
 def cpu_info():
     """
     Get number of CPU cores available
@@ -27,20 +79,26 @@ def cpu_info():
         print(f"Error detecting CPU cores: {e}")
         return 1  # Safe default
 
-def cpu_info_detailed():
+@_ttl_cache(60)
+def cpu_info_detailed(sample_interval=None):
     """
     Get detailed CPU information
     
+    Args:
+        sample_interval: Seconds to sample CPU usage over (blocks for that
+            long); None reports usage since the previous call without waiting
+    
     Returns:
         Dictionary with CPU details
     """
     try:
+        freq = psutil.cpu_freq()
         return {
             'logical_cores': psutil.cpu_count(logical=True),
             'physical_cores': psutil.cpu_count(logical=False),
-            'cpu_percent': psutil.cpu_percent(interval=1),
-            'cpu_freq': psutil.cpu_freq().current if psutil.cpu_freq() else None,
-            'platform': platform.processor()
+            'cpu_percent': psutil.cpu_percent(interval=sample_interval),
+            'cpu_freq': freq.current if freq else None,
+            'platform': _processor_name()
         }
     except Exception as e:
         print(f"Error getting detailed CPU info: {e}")
@@ -52,80 +110,158 @@ def cpu_info_detailed():
             'platform': 'Unknown'
         }
 
+def _probe_nvidia_gpus():
+    """List NVIDIA GPU names via NVML, or nvidia-smi without it"""
+    if _NVML_AVAILABLE:
+        try:
+            return [
+                _nvml_str(pynvml.nvmlDeviceGetName(pynvml.nvmlDeviceGetHandleByIndex(i)))
+                for i in range(pynvml.nvmlDeviceGetCount())
+            ]
+        except pynvml.NVMLError as e:
+            print(f"NVML query failed, falling back to nvidia-smi: {e}")
+    if shutil.which("nvidia-smi") is None:
+        return []
+    result = subprocess.run(
+        ["nvidia-smi", "--query-gpu=name", "--format=csv,noheader"],
+        capture_output=True,
+        text=True,
+        timeout=GPU_PROBE_TIMEOUT
+    )
+    if result.returncode == 0 and result.stdout.strip():
+        return [gpu.strip() for gpu in result.stdout.strip().splitlines()]
+    return []
+
+def _probe_amd_gpus():
+    """List AMD GPU names via rocm-smi"""
+    if shutil.which("rocm-smi") is None:
+        return []
+    result = subprocess.run(
+        ["rocm-smi", "--showproductname"],
+        capture_output=True,
+        text=True,
+        timeout=GPU_PROBE_TIMEOUT
+    )
+    gpus = []
+    if result.returncode == 0 and result.stdout.strip():
+        # Parse rocm-smi output
+        for line in result.stdout.splitlines():
+            if "GPU" in line and ":" in line:
+                gpu_name = line.split(":")[-1].strip()
+                if gpu_name:
+                    gpus.append(f"AMD {gpu_name}")
+    return gpus
+
+def _probe_intel_gpus():
+    """List Intel GPUs from sysfs DRM devices, or via lspci without them (Linux only)"""
+    if platform.system() != "Linux":
+        return []
+    if os.path.isdir(DRM_CLASS_DIR):
+        return _probe_intel_gpus_sysfs()
+    if shutil.which("lspci") is None:
+        return []
+    result = subprocess.run(
+        ["lspci"],
+        capture_output=True,
+        text=True,
+        timeout=GPU_PROBE_TIMEOUT
+    )
+    gpus = []
+    if result.returncode == 0:
+        for line in result.stdout.splitlines():
+            if "VGA" in line and "Intel" in line:
+                # Extract GPU name
+                parts = line.split(":")
+                if len(parts) >= 3:
+                    gpu_name = parts[2].strip()
+                    gpus.append(f"Intel {gpu_name}")
+    return gpus
+
+def _read_sysfs(path):
+    """Stripped contents of a small sysfs attribute file"""
+    with open(path) as f:
+        return f.read().strip()
+
+def _probe_intel_gpus_sysfs():
+    """
+    Intel VGA controllers behind /sys/class/drm/card*: a few attribute reads
+    instead of running lspci and loading the PCI ID database. Without that
+    database the model is reported by its PCI device id.
+    """
+    gpus = []
+    for entry in sorted(os.listdir(DRM_CLASS_DIR)):
+        # cardN only; cardN-<connector> entries are outputs of the same GPU
+        if not (entry.startswith("card") and entry[4:].isdigit()):
+            continue
+        device_dir = os.path.join(DRM_CLASS_DIR, entry, "device")
+        try:
+            if _read_sysfs(os.path.join(device_dir, "vendor")) != INTEL_PCI_VENDOR_ID:
+                continue
+            if not _read_sysfs(os.path.join(device_dir, "class")).startswith(PCI_VGA_CLASS):
+                continue
+            device_id = _read_sysfs(os.path.join(device_dir, "device"))
+        except OSError:
+            continue
+        gpus.append(f"Intel GPU [{device_id}]")
+    return gpus
+
+_GPU_PROBES = (
+    ("NVIDIA", _probe_nvidia_gpus),
+    ("AMD", _probe_amd_gpus),
+    ("Intel", _probe_intel_gpus),
+)
+
+@_ttl_cache(60)
 def gpu_info():
     """
     Get list of available GPUs (NVIDIA, AMD, Intel)
     
+    The vendor probes run concurrently, so a machine lacking all the tools
+    waits for the slowest probe rather than the sum of them.
+    
     Returns:
         List of GPU names (empty list if no GPUs found)
     """
-    gpus = []
-    
-    # Try NVIDIA GPUs first
-    try:
-        result = subprocess.run(
-            ["nvidia-smi", "--query-gpu=name", "--format=csv,noheader"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            gpus.extend([gpu.strip() for gpu in result.stdout.strip().splitlines()])
-    except FileNotFoundError:
-        pass  # nvidia-smi not available
-    except subprocess.TimeoutExpired:
-        pass
-    except Exception as e:
-        print(f"Error checking NVIDIA GPUs: {e}")
-    
-    # Try AMD GPUs
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=len(_GPU_PROBES))
+    futures = {executor.submit(probe): vendor for vendor, probe in _GPU_PROBES}
     try:
-        result = subprocess.run(
-            ["rocm-smi", "--showproductname"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            # Parse rocm-smi output
-            for line in result.stdout.splitlines():
-                if "GPU" in line and ":" in line:
-                    gpu_name = line.split(":")[-1].strip()
-                    if gpu_name:
-                        gpus.append(f"AMD {gpu_name}")
-    except FileNotFoundError:
-        pass  # rocm-smi not available
-    except subprocess.TimeoutExpired:
-        pass
-    except Exception as e:
-        print(f"Error checking AMD GPUs: {e}")
-    
-    # Try Intel GPUs (on Linux)
-    try:
-        if platform.system() == "Linux":
-            result = subprocess.run(
-                ["lspci"],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                for line in result.stdout.splitlines():
-                    if "VGA" in line and "Intel" in line:
-                        # Extract GPU name
-                        parts = line.split(":")
-                        if len(parts) >= 3:
-                            gpu_name = parts[2].strip()
-                            gpus.append(f"Intel {gpu_name}")
-    except FileNotFoundError:
-        pass
-    except subprocess.TimeoutExpired:
-        pass
-    except Exception as e:
-        print(f"Error checking Intel GPUs: {e}")
+        for future in as_completed(futures, timeout=GPU_PROBE_TIMEOUT + 1):
+            vendor = futures[future]
+            try:
+                results[vendor] = future.result()
+            except (FileNotFoundError, subprocess.TimeoutExpired):
+                pass  # Probe tool missing or unresponsive
+            except Exception as e:
+                print(f"Error checking {vendor} GPUs: {e}")
+    except FuturesTimeoutError:
+        pass  # Report whatever finished before the deadline
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
     
+    # Keep the NVIDIA, AMD, Intel ordering regardless of completion order
+    gpus = []
+    for vendor, _ in _GPU_PROBES:
+        gpus.extend(results.get(vendor, ()))
+    return gpus
+
+def _nvml_gpu_details():
+    """Detailed NVIDIA GPU information straight from NVML"""
+    gpus = []
+    for i in range(pynvml.nvmlDeviceGetCount()):
+        handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+        mem = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        gpus.append({
+            'name': _nvml_str(pynvml.nvmlDeviceGetName(handle)),
+            'memory_total_mb': mem.total // (1024**2),
+            'memory_used_mb': mem.used // (1024**2),
+            'memory_free_mb': mem.free // (1024**2),
+            'temperature_c': pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU),
+            'utilization_percent': pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+        })
     return gpus
 
+@_ttl_cache(60)
 def gpu_info_detailed():
     """
     Get detailed GPU information (NVIDIA only for now)
@@ -133,6 +269,12 @@ def gpu_info_detailed():
     Returns:
         List of dictionaries with GPU details
     """
+    if _NVML_AVAILABLE:
+        try:
+            return _nvml_gpu_details()
+        except pynvml.NVMLError as e:
+            print(f"NVML query failed, falling back to nvidia-smi: {e}")
+    
     gpus = []
     
     try:
@@ -168,6 +310,7 @@ def gpu_info_detailed():
     
     return gpus
 
+@_ttl_cache(5)
 def memory_info():
     """
     Get system memory information
@@ -192,6 +335,7 @@ def memory_info():
             'percent': 0
         }
 
+@_ttl_cache(5)
 def disk_info(path='/'):
     """
     Get disk space information for a given path
@@ -219,15 +363,19 @@ def disk_info(path='/'):
             'percent': 0
         }
 
-def system_summary():
+def system_summary(sample_interval=None):
     """
     Get a complete system summary
     
+    Args:
+        sample_interval: CPU usage sampling interval, passed to
+            cpu_info_detailed (default: None, no waiting)
+    
     Returns:
         Dictionary with all system information
     """
     return {
-        'cpu': cpu_info_detailed(),
+        'cpu': cpu_info_detailed(sample_interval),
         'gpu': gpu_info(),
         'memory': memory_info(),
         'disk': disk_info(),
@@ -236,7 +384,7 @@ def system_summary():
             'release': platform.release(),
             'version': platform.version(),
             'machine': platform.machine(),
-            'processor': platform.processor()
+            'processor': _processor_name()
         }
     }
 
@@ -265,17 +413,8 @@ def check_gromacs_requirements():
         warnings.append(f"Low disk space ({disk['free_gb']:.1f} GB free). At least 50 GB recommended.")
     
     # Check if GROMACS is installed
-    try:
-        result = subprocess.run(
-            ["which", "gmx"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        if result.returncode != 0:
-            warnings.append("GROMACS (gmx) not found in PATH. Please install GROMACS.")
-    except Exception:
-        warnings.append("Could not check for GROMACS installation.")
+    if shutil.which("gmx") is None:
+        warnings.append("GROMACS (gmx) not found in PATH. Please install GROMACS.")
     
     meets_requirements = len(warnings) == 0
     return meets_requirements, warnings